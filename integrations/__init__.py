@@ -0,0 +1,36 @@
+"""
+Common utilities enabling interaction with specific tools.
+
+Submodules are imported lazily on first access (PEP 562), e.g. `integrations.pushme`,
+and heavy optional SDKs are only imported on first use inside each submodule.
+"""
+
+import importlib
+
+__all__ = [
+    "aio",
+    "firebase",
+    "habitica",
+    "image_host",
+    "image_process",
+    "llm",
+    "mail",
+    "metrics",
+    "notion",
+    "outbox",
+    "pushme",
+    "utils",
+    "webdav",
+]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        module = importlib.import_module(f".{name}", __name__)
+        globals()[name] = module  # cache, skip __getattr__ next time
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
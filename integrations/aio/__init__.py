@@ -0,0 +1,121 @@
+"""
+asyncio counterparts of the HTTP based integrations, e.g. `habitica.aio.create_tasks`.
+
+All of them share one pooled `aiohttp.ClientSession` per event loop, call `aclose()` before the loop ends.
+Configuration is shared with the sync modules: call `habitica.init(...)` etc. first.
+"""
+
+import asyncio
+import json as jsonlib
+import sys
+import weakref
+from typing import Any, NamedTuple
+from urllib.parse import urlencode
+
+from urllib3 import encode_multipart_formdata
+
+from .. import metrics
+from ..utils import LazyImport
+
+aiohttp = LazyImport("aiohttp", "aio")  # imported on first use
+
+MAX_CONNECTIONS = 100
+TIMEOUT = 30.0
+
+_sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # event loop -> ClientSession
+
+
+def session():
+    "shared aiohttp session of the running event loop"
+    loop = asyncio.get_running_loop()
+    http = _sessions.get(loop)
+    if http is None or http.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+        http = _sessions[loop] = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=TIMEOUT)
+        )
+    return http
+
+
+async def aclose():
+    "close the shared session (and `llm.aio` clients) of the running event loop"
+    if (http := _sessions.pop(asyncio.get_running_loop(), None)) is not None:
+        await http.close()
+    if (llm := sys.modules.get(f"{__name__}.llm")) is not None:
+        await llm.aclose()
+
+
+class Request(NamedTuple):
+    method: str
+    url: str
+    body: bytes | None
+
+
+class Response:
+    "fully read response, with the `requests.Response` attributes used by the sync modules"
+
+    def __init__(self, raw, content: bytes, request: Request):
+        self.raw = raw
+        self.status_code: int = raw.status
+        self.headers = raw.headers
+        self.url = str(raw.url)
+        self.content = content
+        self.request = request
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(errors="replace")
+
+    def json(self) -> Any:
+        return jsonlib.loads(self.content)
+
+    def raise_for_status(self):
+        self.raw.raise_for_status()
+
+
+async def request(
+    method: str,
+    url: str,
+    *,
+    headers: dict | None = None,
+    json: Any = None,
+    data: dict | bytes | None = None,
+    files: dict[str, tuple[str, bytes]] | None = None,
+    timeout: float | None = None,
+) -> Response:
+    """
+    send a request with the shared session and read the whole response
+    json / data / files are encoded like `requests` does (files: {field: (filename, bytes)})
+    """
+    headers = dict(headers or {})
+    content_type = None
+    if files is not None:
+        body, content_type = encode_multipart_formdata({**(data or {}), **files})  # type: ignore[dict-item]
+    elif json is not None:
+        body, content_type = jsonlib.dumps(json).encode(), "application/json"
+    elif isinstance(data, dict):
+        body, content_type = urlencode(data).encode(), "application/x-www-form-urlencoded"
+    else:
+        body = data
+    if content_type and not any(k.lower() == "content-type" for k in headers):
+        headers["Content-Type"] = content_type
+
+    kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout is not None else {}
+    async with session().request(method, url, headers=headers, data=body, **kwargs) as raw:
+        content = await raw.read()
+    return Response(raw, content, Request(method, url, body))
+
+
+class RateLimit:
+    "shared pause for all coroutines of a service after a rate limit response (no thread is blocked)"
+
+    def __init__(self):
+        self.resume_at = 0.0
+
+    def pause(self, seconds: float):
+        self.resume_at = max(self.resume_at, asyncio.get_running_loop().time() + seconds)
+
+    async def wait(self):
+        "wait for the pause to end, the time waited is accounted to the running call"
+        while (delay := self.resume_at - asyncio.get_running_loop().time()) > 0:
+            await metrics.asleep(delay)
@@ -0,0 +1,127 @@
+"asyncio counterpart of `integrations.habitica`"
+
+import asyncio
+from typing import Iterable
+from urllib.parse import urlencode
+
+from loguru import logger
+
+from .. import habitica, metrics
+from ..habitica import Task, cfg
+from . import RateLimit, request
+
+rate_limit = RateLimit()
+
+
+async def _request(operation: str, method: str, url: str, retry: bool = True, **kwargs) -> tuple[str, object]:
+    "send a request (retry once like the sync module), return check result and response"
+    with metrics.operation("habitica", operation) as call:
+        for attempt in range(2 if retry else 1):
+            if attempt:
+                call.retries += 1
+            await rate_limit.wait()
+            response = await request(method, url, headers=cfg.headers, **kwargs)
+            call.observe(response)
+            result, wait = habitica._classify(response)
+            if wait:
+                rate_limit.pause(wait)  # slept by the next `rate_limit.wait()`
+            if result in ("Success", "NotFound"):
+                break
+    return result, response
+
+
+@cfg.check_initialized
+async def get_bot_tag() -> str:
+    """return uuid of 'bot' tag (cache shared with `habitica.get_bot_tag`)"""
+    if habitica._bot_tag is not None:
+        return habitica._bot_tag
+    _, response = await _request("get_tags", "GET", f"{habitica.BASE_URL}/tags", retry=False)
+    return habitica._bot_tag_id(response.json()["data"])
+
+
+@cfg.check_initialized
+async def create_tasks(tasks: list[Task], concurrency: int = 10) -> list[Task]:
+    """
+    create a list of tasks concurrently
+    return tasks that failed to create
+    """
+    url = f"{habitica.BASE_URL}/tasks/user"
+    bot_tag = await get_bot_tag()
+    semaphore = asyncio.Semaphore(concurrency)
+    logger.debug(f"create {len(tasks)} task")
+
+    async def create(task: Task) -> bool:
+        payload = {
+            "text": task.text,
+            "type": task.type,
+            "notes": task.notes,
+            "tags": [bot_tag],  # indicate that the task is created by a bot
+        }
+        async with semaphore:
+            result, _ = await _request("create_task", "POST", url, json=payload)
+            if result == "NotFound":  # the bot tag may have been recreated
+                habitica._invalidate_bot_tag()
+                payload["tags"] = [await get_bot_tag()]
+                result, _ = await _request("create_task", "POST", url, json=payload)
+        if result != "Success":
+            logger.error(f"{task} created failed ({result})")
+        return result == "Success"
+
+    results = await asyncio.gather(*map(create, tasks))
+    return [task for task, ok in zip(tasks, results) if not ok]
+
+
+@cfg.check_initialized
+async def delete_bot_tasks(concurrency: int = 10) -> list[dict]:
+    "delete bot tasks concurrently, return tasks that failed to delete"
+    bot_tag = await get_bot_tag()
+    _, response = await _request("get_tasks", "GET", f"{habitica.BASE_URL}/tasks/user", retry=False)
+    tasks = [t for t in response.json()["data"] if bot_tag in t["tags"] and t["type"] == "todo"]
+    semaphore = asyncio.Semaphore(concurrency)
+    logger.debug(f"delete {len(tasks)} task")
+
+    async def delete(task: dict) -> bool:
+        async with semaphore:
+            result, _ = await _request("delete_task", "DELETE", f"{habitica.BASE_URL}/tasks/{task['id']}")
+        if result != "Success":
+            logger.error(f"Failed to delete task {task}. ({result})")
+        return result == "Success"
+
+    results = await asyncio.gather(*map(delete, tasks))
+    return [task for task, ok in zip(tasks, results) if not ok]
+
+
+@cfg.check_initialized
+async def get_user(fields: Iterable[str] = ("stats",), max_age: float = habitica.USER_MAX_AGE) -> dict:
+    "see `habitica.get_user`, the cache is shared"
+    fields = list(fields)
+    user, missing = habitica._cached_user(fields, max_age)
+    if missing:
+        url = f"{habitica.BASE_URL}/user/?{urlencode({'userFields': ','.join(missing)})}"
+        _, response = await _request("get_user", "GET", url, retry=False)
+        data = response.json()["data"]
+        habitica._store_user(data)
+        user.update(habitica._user_fields(data, missing))
+    return user
+
+
+@cfg.check_initialized
+async def get_user_stats(max_age: float = habitica.USER_MAX_AGE) -> dict:
+    return (await get_user(["stats"], max_age))["stats"]
+
+
+@cfg.check_initialized
+async def lose_gp(amount: int, max_age: float = 0) -> float:
+    "lose gold coins, return current gold coins, see `habitica.lose_gp`"
+    stats = await get_user_stats(max_age)
+    target_hp = stats["hp"]
+    target_gp = stats["gp"] - amount
+    if target_gp < 0:  # lose hp when gp is not enough
+        target_hp = max(0, target_hp + target_gp)
+        target_gp = 0
+
+    payload = {"stats.gp": target_gp, "stats.hp": target_hp}
+    _, response = await _request("update_user", "PUT", f"{habitica.BASE_URL}/user/", retry=False, json=payload)
+    user = response.json()["data"]  # the updated user
+    habitica._store_user(user)
+    return user["stats"]["gp"]
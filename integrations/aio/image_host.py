@@ -0,0 +1,53 @@
+"asyncio counterpart of `integrations.image_host`"
+
+from os.path import exists
+from typing import AsyncGenerator
+
+from .. import image_host, metrics
+from ..image_host import cfg
+from . import request
+
+
+@cfg.check_initialized
+async def upload_image(source: str | bytes, name: str, bucket: str = "img") -> str:
+    """
+    upload image from file path or raw bytes
+    name: filename
+    bucket: this will add a prefix to the image name to distinguish different tasks.
+    """
+    if isinstance(source, str):
+        assert exists(source), "image does not exist"
+        with open(source, "rb") as f:
+            source = f.read()
+    assert isinstance(source, bytes), "invalid source type"
+
+    files = {"smfile": (f"{bucket}-{name}", source)}
+    with metrics.operation("image_host", "upload") as call:
+        response = await request("POST", f"{image_host.BASE_URL}/upload", files=files, headers=cfg.headers)
+        call.observe(response)
+
+    res = response.json()
+    match res["code"]:
+        case "success":
+            return res["data"]["url"]
+        case "image_repeated":
+            return res["images"]  # previously uploaded url
+        case _:  # unsupported conditions
+            raise Exception(f"{res['code']}: {res['message']}\ndata:\n {res}")
+
+
+@cfg.check_initialized
+async def image_list() -> AsyncGenerator[dict, None]:
+    "get all uploaded images"
+    url = f"{image_host.BASE_URL}/upload_history"
+    page, total = 1, 1
+    while page <= total:
+        with metrics.operation("image_host", "upload_history") as call:
+            # the sync module sends the page as form data of a GET request
+            response = await request("GET", url, data={"page": page}, headers=cfg.headers)
+            call.observe(response)
+        res = response.json()
+        for item in res["data"]:
+            yield item
+        total = res["TotalPages"]
+        page += 1
@@ -0,0 +1,61 @@
+"asyncio counterpart of `integrations.image_process`"
+
+from urllib.parse import urlsplit
+
+from cachetools import TTLCache
+from loguru import logger
+
+from .. import image_process, metrics
+from ..image_process import cfg
+from . import request
+
+_tokens: TTLCache = TTLCache(maxsize=10, ttl=3600)  # signed tokens expire after 2 hours
+
+
+async def request_signed_token(public_key: str) -> str:
+    if (token := _tokens.get(public_key)) is None:
+        with metrics.operation("image_process", "auth") as call:
+            response = await request("POST", f"{image_process.BASE_URL}/auth", json={"public_key": public_key})
+            call.observe(response)
+        token = _tokens[public_key] = response.json()["token"]
+    return token
+
+
+async def _call(operation: str, method: str, url: str, **kwargs):
+    with metrics.operation("image_process", operation) as call:
+        response = await request(method, url, **kwargs)
+        call.observe(response)
+    return response
+
+
+@cfg.check_initialized
+async def compress_image(image: bytes, ext=".png") -> bytes:
+    """
+    image: image bytes
+    ext: image file extension, inconsistency with true image type may leads to bad compression result (especially for png)
+    return: processed image bytes
+    """
+    token = await request_signed_token(cfg.public_key)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    logger.debug("start compress image")
+    res = (await _call("start", "GET", f"{image_process.BASE_URL}/start/compressimage", headers=headers)).json()
+    task = res["task"]
+    server = f"{urlsplit(image_process.BASE_URL).scheme}://{res['server']}"
+
+    logger.debug("upload image")
+    files = {"file": ("filename" + ext, image)}
+    res = (await _call("upload", "POST", f"{server}/v1/upload", headers=headers, files=files, data={"task": task})).json()
+
+    logger.debug("process image")
+    data = {
+        "task": task,
+        "tool": "compressimage",
+        "files": [{"server_filename": res["server_filename"], "filename": "filename" + ext}],
+    }
+    await _call("process", "POST", f"{server}/v1/process", headers=headers, json=data)
+
+    logger.debug("download image")
+    response = await _call("download", "GET", f"{server}/v1/download/{task}", headers=headers)
+    response.raise_for_status()
+    return response.content
@@ -0,0 +1,88 @@
+"""
+asyncio counterpart of the streaming functions of `integrations.llm`
+uses one `openai.AsyncOpenAI` per event loop and endpoint, closed by `aio.aclose()`
+"""
+
+import asyncio
+import time
+import weakref
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+from .. import llm, metrics
+from ..llm import _delta, _messages, _retry_after, cfg, openai
+
+_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # event loop -> {(api_key, base_url, max_retries): client}
+
+
+def _client(api_key: str, base_url: str, max_retries: int | None = None):
+    "shared client of the running event loop for an endpoint"
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    key = (api_key, base_url, max_retries)
+    if key not in clients:
+        options = {} if max_retries is None else {"max_retries": max_retries}
+        clients[key] = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, **options)
+    return clients[key]
+
+
+async def aclose():
+    "close the clients of the running event loop"
+    for client in _clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.close()
+
+
+async def _stream(endpoint: dict, operation: str, **kwargs) -> AsyncIterator[str]:
+    "async counterpart of `llm._stream`, `endpoint`: arguments of `_client`"
+    client = _client(**endpoint)
+    call = metrics.Call("llm", operation, urlsplit(str(client.base_url)).netloc)
+    start = time.perf_counter()
+    try:
+        try:
+            stream = await client.chat.completions.create(stream=True, **kwargs)
+        except openai.RateLimitError as e:
+            retry_after = _retry_after(e)
+            if retry_after is None:
+                raise e
+            call.rate_limit_sleep += retry_after
+            call.retries += 1
+            await asyncio.sleep(retry_after)
+            stream = await client.chat.completions.create(stream=True, **kwargs)
+        async with stream:
+            async for chunk in stream:
+                if delta := _delta(chunk, call):
+                    if not call.time_to_first_token:
+                        call.time_to_first_token = time.perf_counter() - start
+                    yield delta
+    except Exception as e:
+        call.status = type(e).__name__
+        raise
+    finally:
+        call.latency = time.perf_counter() - start
+        metrics.record(call)
+
+
+@cfg.check_initialized
+def stream_moonshot(query: str, role: str) -> AsyncIterator[str]:
+    "like `llm.stream_moonshot`, use with `async for`"
+    endpoint = {
+        "api_key": cfg.api_key,
+        "base_url": llm.MOONSHOT_BASE_URL,
+        "max_retries": 0,  # no retry, it makes harder to handle rate limit error
+    }
+    return _stream(
+        endpoint, "stream_moonshot", model="moonshot-v1-8k", messages=_messages(query, role), temperature=0.6
+    )
+
+
+@cfg.check_initialized
+def stream_deepseek(query: str, role: str) -> AsyncIterator[str]:
+    "like `llm.stream_deepseek`, use with `async for`"
+    endpoint = {"api_key": cfg.api_key, "base_url": llm.DEEPSEEK_BASE_URL}
+    return _stream(
+        endpoint,
+        "stream_deepseek",
+        model="deepseek-chat",
+        messages=_messages(query, role),
+        max_tokens=1024,
+        temperature=0.7,
+    )
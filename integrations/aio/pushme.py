@@ -0,0 +1,24 @@
+"asyncio counterpart of `integrations.pushme`"
+
+from .. import metrics, pushme
+from ..pushme import Theme, cfg
+from . import request
+
+
+@cfg.check_initialized
+async def push(title: str, content: str, type: str = "markdown", theme: Theme = Theme.info):
+    """Push a notification to your device.
+
+    - type: markdown | text
+    - theme: Theme (info, success, warning, failure)
+    """
+    data = {
+        "push_key": cfg.push_key,
+        "title": str(theme) + title,
+        "content": content,
+        "type": type,
+    }
+    with metrics.operation("pushme", "push") as call:
+        response = await request("POST", pushme.URL, json=data, timeout=5)
+        call.observe(response)
+    response.raise_for_status()
@@ -0,0 +1 @@
+"offline benchmarks, run with `python -m integrations.benchmarks.<name>`"
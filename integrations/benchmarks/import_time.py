@@ -0,0 +1,72 @@
+"""
+Import time of each integration module, measured with `python -X importtime`.
+
+    python -m integrations.benchmarks.import_time > import_time.json
+    python -m integrations.benchmarks.import_time --baseline import_time.json
+
+With `--baseline`, exit with status 1 if any module got slower than `--tolerance` (ratio).
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+MODULES = [
+    "integrations",
+    "integrations.aio",
+    "integrations.firebase",
+    "integrations.habitica",
+    "integrations.image_host",
+    "integrations.image_process",
+    "integrations.llm",
+    "integrations.mail",
+    "integrations.metrics",
+    "integrations.notion",
+    "integrations.outbox",
+    "integrations.pushme",
+    "integrations.webdav",
+]
+
+
+def import_time(module: str, repeat: int = 5) -> float:
+    "best cumulative import time (ms) of a module in a fresh interpreter"
+    best = float("inf")
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # lines look like: "import time:  self [us] | cumulative | imported package"
+        pattern = rf"^import time:\s+\d+ \|\s+(\d+) \| {re.escape(module)}$"
+        cumulative = int(re.findall(pattern, result.stderr, re.M)[-1])
+        best = min(best, cumulative / 1000)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", help="json output of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown ratio")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {m: round(import_time(m, args.repeat), 2) for m in MODULES}
+    print(json.dumps({"import_time_ms": results}, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["import_time_ms"]
+        regressions = {
+            m: (baseline[m], t) for m, t in results.items() if m in baseline and t > baseline[m] * args.tolerance
+        }
+        for m, (before, after) in regressions.items():
+            print(f"regression: {m} {before}ms -> {after}ms", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
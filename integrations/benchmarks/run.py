@@ -0,0 +1,491 @@
+"""
+Offline benchmarks of the integration hot paths against local stand-in servers.
+
+    python -m integrations.benchmarks.run > bench.json
+    python -m integrations.benchmarks.run --compare bench.json  # exit 1 on regression
+    python -m integrations.benchmarks.run --only habitica --latency 0.02 --rate-limit 0.05
+
+Each scenario reports throughput, p50/p99 latency and peak (python) memory of one operation.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Iterator
+
+from loguru import logger
+
+from . import servers
+
+Scenario = Callable[[argparse.Namespace], contextlib.AbstractContextManager[Callable[[], object]]]
+SCENARIOS: dict[str, Scenario] = {}
+
+
+def scenario(name: str):
+    "register a scenario: a context manager factory yielding the operation to measure"
+
+    def decorator(func):
+        SCENARIOS[name] = contextlib.contextmanager(func)
+        return func
+
+    return decorator
+
+
+def fake_server(routes: servers.Routes, args: argparse.Namespace) -> servers.FakeServer:
+    return servers.FakeServer(
+        routes, latency=args.latency, rate_limit_rate=args.rate_limit, bad_gateway_rate=args.bad_gateway
+    )
+
+
+@contextlib.contextmanager
+def patched(module, **attrs):
+    "temporarily set module attributes (eg. base urls)"
+    old = {k: getattr(module, k) for k in attrs}
+    for k, v in attrs.items():
+        setattr(module, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            setattr(module, k, v)
+
+
+# ---- scenarios ----
+
+
+@scenario("habitica.create_tasks")
+def _(args) -> Iterator[Callable]:
+    from .. import habitica
+
+    with fake_server(servers.habitica_routes(), args) as server, patched(habitica, BASE_URL=f"{server.url}/api/v3"):
+        habitica.init("user", "key")
+        tasks = [habitica.Task(f"task {i}", "benchmark") for i in range(20)]
+        yield lambda: habitica.create_tasks(tasks)
+
+
+@scenario("habitica.delete_bot_tasks")
+def _(args) -> Iterator[Callable]:
+    from .. import habitica
+
+    with fake_server(servers.habitica_routes(), args) as server, patched(habitica, BASE_URL=f"{server.url}/api/v3"):
+        habitica.init("user", "key")
+        tasks = [habitica.Task(f"task {i}", "benchmark") for i in range(20)]
+
+        def op():
+            habitica.create_tasks(tasks)
+            habitica.delete_bot_tasks()
+
+        yield op
+
+
+@contextlib.contextmanager
+def event_loop() -> Iterator[asyncio.AbstractEventLoop]:
+    "one loop for all iterations, so the shared async client is reused"
+    from .. import aio
+
+    loop = asyncio.new_event_loop()
+    try:
+        yield loop
+    finally:
+        loop.run_until_complete(aio.aclose())
+        loop.close()
+
+
+@scenario("habitica.aio.create_tasks")
+def _(args) -> Iterator[Callable]:
+    from .. import habitica
+
+    with (
+        fake_server(servers.habitica_routes(), args) as server,
+        patched(habitica, BASE_URL=f"{server.url}/api/v3"),
+        event_loop() as loop,
+    ):
+        habitica.init("user", "key")
+        tasks = [habitica.Task(f"task {i}", "benchmark") for i in range(20)]
+        yield lambda: loop.run_until_complete(habitica.aio.create_tasks(tasks))
+
+
+@scenario("habitica.aio.create_tasks.faults")
+def _(args) -> Iterator[Callable]:
+    "429 / 502 responses go through the rate limit path, also without metrics sinks"
+    from .. import habitica
+
+    routes = servers.habitica_routes()
+    with (
+        servers.FakeServer(routes, latency=args.latency, rate_limit_rate=0.2, bad_gateway_rate=0.02) as server,
+        patched(habitica, BASE_URL=f"{server.url}/api/v3"),
+        event_loop() as loop,
+    ):
+        habitica.init("user", "key")
+        tasks = [habitica.Task(f"task {i}", "benchmark") for i in range(20)]
+        yield lambda: loop.run_until_complete(habitica.aio.create_tasks(tasks))
+
+
+@scenario("habitica.lose_gp")
+def _(args) -> Iterator[Callable]:
+    from .. import habitica
+
+    with fake_server(servers.habitica_routes(), args) as server, patched(habitica, BASE_URL=f"{server.url}/api/v3"):
+        habitica.init("user", "key")
+        yield lambda: habitica.lose_gp(0)
+
+
+@scenario("habitica.lose_gp.batched")
+def _(args) -> Iterator[Callable]:
+    from .. import habitica
+
+    with fake_server(servers.habitica_routes(), args) as server, patched(habitica, BASE_URL=f"{server.url}/api/v3"):
+        habitica.init("user", "key")
+        yield lambda: habitica.lose_gp(0, max_age=habitica.USER_MAX_AGE)
+
+
+@scenario("image_host.upload_image")
+def _(args) -> Iterator[Callable]:
+    from .. import image_host
+
+    with fake_server(servers.smms_routes(), args) as server, patched(image_host, BASE_URL=f"{server.url}/api/v2"):
+        image_host.init("token")
+        image = os.urandom(100_000)
+        yield lambda: image_host.upload_image(image, "bench.png")
+
+
+@scenario("image_host.image_list")
+def _(args) -> Iterator[Callable]:
+    from .. import image_host
+
+    with fake_server(servers.smms_routes(), args) as server, patched(image_host, BASE_URL=f"{server.url}/api/v2"):
+        image_host.init("token")
+        yield lambda: list(image_host.image_list())
+
+
+@scenario("image_host.aio.upload_image")
+def _(args) -> Iterator[Callable]:
+    from .. import image_host
+
+    with (
+        fake_server(servers.smms_routes(), args) as server,
+        patched(image_host, BASE_URL=f"{server.url}/api/v2"),
+        event_loop() as loop,
+    ):
+        image_host.init("token")
+        image = os.urandom(100_000)
+
+        async def upload_many():  # 20 concurrent uploads
+            await asyncio.gather(*(image_host.aio.upload_image(image, f"bench-{i}.png") for i in range(20)))
+
+        yield lambda: loop.run_until_complete(upload_many())
+
+
+@scenario("image_process.compress_image")
+def _(args) -> Iterator[Callable]:
+    from .. import image_process
+
+    with fake_server(servers.iloveimg_routes(), args) as server, patched(image_process, BASE_URL=f"{server.url}/v1"):
+        image_process.init("public-key")
+        image = os.urandom(200_000)
+        yield lambda: image_process.compress_image(image)
+
+
+@scenario("pushme.push")
+def _(args) -> Iterator[Callable]:
+    from .. import pushme
+
+    with fake_server(servers.pushme_routes(), args) as server, patched(pushme, URL=server.url):
+        pushme.init("push-key")
+        yield lambda: pushme.push("benchmark", "content")
+
+
+@scenario("pushme.aio.push")
+def _(args) -> Iterator[Callable]:
+    from .. import pushme
+
+    with fake_server(servers.pushme_routes(), args) as server, patched(pushme, URL=server.url), event_loop() as loop:
+        pushme.init("push-key")
+
+        async def push_many():  # 100 concurrent notifications
+            await asyncio.gather(*(pushme.aio.push("benchmark", "content") for _ in range(100)))
+
+        yield lambda: loop.run_until_complete(push_many())
+
+
+@scenario("notion.retrieve_block_children_recursive")
+def _(args) -> Iterator[Callable]:
+    from .. import notion
+
+    with fake_server(servers.notion_routes(depth=3, fanout=5), args) as server:
+        notion.client = notion.notion_client.Client(auth="secret", base_url=server.url)
+        yield lambda: list(notion.retrieve_block_children_recursive("root"))
+
+
+@scenario("notion.retrieve_block_children_recursive.cached")
+def _(args) -> Iterator[Callable]:
+    from .. import notion
+
+    with (
+        fake_server(servers.notion_routes(depth=3, fanout=5), args) as server,
+        tempfile.TemporaryDirectory() as folder,
+        notion.BlockCache(f"{folder}/blocks.db") as cache,
+    ):
+        notion.client = notion.notion_client.Client(auth="secret", base_url=server.url)
+        yield lambda: list(notion.retrieve_block_children_recursive("root", cache=cache))  # unchanged page
+
+
+@scenario("llm.ask_deepseek")
+def _(args) -> Iterator[Callable]:
+    from .. import llm
+
+    with fake_server(servers.openai_routes(), args) as server, patched(llm, DEEPSEEK_BASE_URL=server.url):
+        llm.init("api-key")
+        yield lambda: llm.ask_deepseek("question", "you are a benchmark")
+
+
+@scenario("llm.stream_deepseek.first_token")
+def _(args) -> Iterator[Callable]:
+    from .. import llm
+
+    routes = servers.openai_routes(token_interval=0.002)
+    with fake_server(routes, args) as server, patched(llm, DEEPSEEK_BASE_URL=server.url):
+        llm.init("api-key")
+
+        def first_token():  # what a relay waits for before forwarding anything
+            stream = llm.stream_deepseek("question", "you are a benchmark")
+            next(stream)
+            stream.close()
+
+        yield first_token
+
+
+@scenario("llm.map_reduce")
+def _(args) -> Iterator[Callable]:
+    from .. import llm
+
+    text = "\n\n".join(f"paragraph {i}: " + "some benchmark text. " * 40 for i in range(1000))  # ~850k characters
+    with fake_server(servers.openai_routes(), args) as server, patched(llm, DEEPSEEK_BASE_URL=server.url):
+        llm.init("api-key")
+        yield lambda: llm.map_reduce(text, "summarize", "combine", ask=llm.ask_deepseek, concurrency=16)
+
+
+def router_scenario(args, hedge: bool):
+    "two providers with 3% slow (0.3 s) outliers, compare p99 with and without hedging"
+    from .. import llm
+
+    def provider_server(seed: int) -> servers.FakeServer:
+        return servers.FakeServer(
+            servers.openai_routes(), latency=args.latency, tail_rate=0.03, tail_latency=0.3, seed=seed
+        )
+
+    with provider_server(1) as a, provider_server(2) as b:
+        providers = [llm.Provider("a", a.url, "key", "model-a"), llm.Provider("b", b.url, "key", "model-b")]
+        with llm.Router(providers, hedge=hedge, hedge_after=0.1) as router:
+            yield lambda: router.ask("question", "you are a benchmark")
+
+
+@scenario("llm.Router.ask")
+def _(args) -> Iterator[Callable]:
+    yield from router_scenario(args, hedge=False)
+
+
+@scenario("llm.Router.ask.hedged")
+def _(args) -> Iterator[Callable]:
+    yield from router_scenario(args, hedge=True)
+
+
+@scenario("mail.send_mail")
+def _(args) -> Iterator[Callable]:
+    from .. import mail
+
+    with servers.SMTPSink(latency=args.latency) as sink:
+        host, port = sink.address
+        mail.init(host, port, "bench@localhost", "password", use_ssl=False)
+        yield lambda: mail.send_mail("benchmark", "content " * 100, ["to@localhost"])
+
+
+@scenario("webdav.JGY.upload_file")
+def _(args) -> Iterator[Callable]:
+    from .. import webdav
+
+    with servers.FakeWebDAV(latency=args.latency) as server, tempfile.TemporaryDirectory() as folder:
+        jgy = webdav.JGY(server.url, "user", "password")
+        source = os.path.join(folder, "upload.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(1 << 20))
+        yield lambda: jgy.upload_file(source, overwrite=True)
+
+
+@scenario("webdav.JGY.download_file")
+def _(args) -> Iterator[Callable]:
+    from .. import webdav
+
+    with servers.FakeWebDAV(latency=args.latency) as server, tempfile.TemporaryDirectory() as folder:
+        jgy = webdav.JGY(server.url, "user", "password")
+        jgy.upload_file_obj(io.BytesIO(os.urandom(16 << 20)), "large.bin")
+        dest = os.path.join(folder, "large.bin")
+        yield lambda: jgy.download_file("large.bin", dest)
+
+
+@scenario("firebase.SimpleDocument.update")
+def _(args) -> Iterator[Callable]:
+    from .. import firebase
+
+    firebase.cfg.db = servers.FakeFirestore(latency=args.latency)
+    firebase.cfg.mark_initialized()
+    doc = firebase.request_document("config", "app")
+
+    def op():
+        for i in range(20):
+            doc.update(counter=i)
+
+    yield op
+
+
+@scenario("firebase.SimpleDocument.update.buffered")
+def _(args) -> Iterator[Callable]:
+    from .. import firebase
+
+    firebase.cfg.db = servers.FakeFirestore(latency=args.latency)
+    firebase.cfg.mark_initialized()
+
+    def op():
+        with firebase.write_buffer(interval=None) as buffer:
+            doc = firebase.request_document("config", "app", buffer=buffer)
+            for i in range(20):
+                doc.update(counter=i)
+
+    yield op
+
+
+@scenario("firebase.SimpleDocument.get.live")
+def _(args) -> Iterator[Callable]:
+    from .. import firebase
+
+    firebase.cfg.db = servers.FakeFirestore(latency=args.latency)
+    firebase.cfg.mark_initialized()
+    counter = iter(range(1 << 30))
+
+    def op():  # missing -> written -> deleted, reads are served by the snapshot listener
+        doc = firebase.request_document("config", f"live-{next(counter)}", live=True)
+        try:
+            assert doc.get() == {}
+            doc.update(counter=1)
+            for _ in range(20):
+                assert doc.get() == {"counter": 1}
+            doc.doc_ref.delete()
+            assert doc.get() == {}
+        finally:
+            doc.close()
+
+    yield op
+
+
+@scenario("firebase.get_many")
+def _(args) -> Iterator[Callable]:
+    from .. import firebase
+
+    db = servers.FakeFirestore(latency=args.latency)
+    db.docs.update({f"config/doc-{i}": {"value": i} for i in range(300)})
+    firebase.cfg.db = db
+    firebase.cfg.mark_initialized()
+    ids = [f"doc-{i}" for i in range(300)]
+    yield lambda: list(firebase.get_many("config", ids))
+
+
+# ---- measurement ----
+
+
+def measure(op: Callable[[], object], iterations: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        op()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        op()
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+
+    tracemalloc.start()  # separate run, tracing slows down the operation
+    op()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "iterations": iterations,
+        "throughput_ops_s": round(iterations / total, 3),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    "return descriptions of regressions beyond tolerance (ratio)"
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or "error" in result or "error" in baseline[name]:
+            continue
+        before = baseline[name]
+        for key in ["p50_ms", "p99_ms", "peak_memory_kb"]:
+            if before[key] and result[key] > before[key] * tolerance:
+                regressions.append(f"{name} {key}: {before[key]} -> {result[key]}")
+        if result["throughput_ops_s"] * tolerance < before["throughput_ops_s"]:
+            regressions.append(f"{name} throughput_ops_s: {before['throughput_ops_s']} -> {result['throughput_ops_s']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="*", default=[], help="run scenarios whose name starts with any of these")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added by fake servers per request")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="probability of 429 responses")
+    parser.add_argument("--bad-gateway", type=float, default=0.0, help="probability of 502 responses")
+    parser.add_argument("--compare", help="json output of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown ratio")
+    args = parser.parse_args()
+
+    logger.disable("integrations")
+    results = {}
+    for name, factory in SCENARIOS.items():
+        if args.only and not name.startswith(tuple(args.only)):
+            continue
+        try:  # some clients print progress, keep stdout for the json report
+            with contextlib.redirect_stdout(sys.stderr), factory(args) as op:
+                results[name] = measure(op, args.iterations)
+        except ImportError as e:  # optional dependency not installed
+            print(f"skip {name}: {e}", file=sys.stderr)
+        except Exception as e:  # eg. injected faults the operation does not handle
+            results[name] = {"error": repr(e)}
+
+    try:
+        version = importlib.metadata.version("integrations")
+    except importlib.metadata.PackageNotFoundError:
+        version = "unknown"
+    meta = {
+        "version": version,
+        "python": platform.python_version(),
+        **{k: getattr(args, k) for k in ["iterations", "latency", "rate_limit", "bad_gateway"]},
+    }
+    print(json.dumps({"meta": meta, "results": results}, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
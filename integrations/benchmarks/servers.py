@@ -0,0 +1,669 @@
+"""
+Local stand-in servers for offline benchmarks.
+
+- `FakeServer`: HTTP server dispatching to route handlers, with latency and 429/502 injection
+- `*_routes`: routes mimicking Habitica, sm.ms, iloveimg, push.i-i.me, Notion and OpenAI-compatible APIs
+- `FakeWebDAV`: in-memory WebDAV server (PROPFIND, MKCOL, PUT, GET with Range, HEAD)
+- `SMTPSink`: plain SMTP server accepting and discarding mails
+- `FakeFirestore`: in-memory stand-in for `firestore.Client` with per-RPC latency
+"""
+
+import base64
+import copy
+import hashlib
+import itertools
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator, NamedTuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: dict[str, str]
+    headers: dict[str, str]
+    body: bytes
+    match: re.Match
+
+    def json(self) -> Any:
+        return json.loads(self.body or b"null")
+
+
+class Response(NamedTuple):
+    status: int = 200
+    body: Any = None  # dict/list is sent as json, bytes as is, an iterator of bytes chunked as it yields
+    headers: dict[str, str] = {}
+
+
+Routes = dict[tuple[str, str], Callable[[Request], Response]]
+
+
+class _ThreadingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeServer:
+    """
+    Local HTTP server for benchmarks, use as a context manager.
+    routes: {(method, path regex): handler}, the regex must match the whole path
+    latency: seconds slept before each response
+    tail_rate / tail_latency: probability of sleeping `tail_latency` more (slow outliers)
+    rate_limit_rate / bad_gateway_rate: probability of answering 429 (with Retry-After) / 502
+    """
+
+    def __init__(
+        self,
+        routes: Routes,
+        latency: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        bad_gateway_rate: float = 0.0,
+        retry_after: float = 0.01,
+        tail_rate: float = 0.0,
+        tail_latency: float = 0.0,
+        seed: int = 0,
+    ):
+        self.routes = [(method, re.compile(path), handler) for (method, path), handler in routes.items()]
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.bad_gateway_rate = bad_gateway_rate
+        self.retry_after = retry_after
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        "host:port"
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def dispatch(self, request_line: tuple[str, str], headers: dict[str, str], body: bytes) -> Response:
+        method, target = request_line
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.tail_rate and self.random.random() < self.tail_rate:
+            time.sleep(self.tail_latency)
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return Response(429, {"error": "TooManyRequests"}, {"Retry-After": str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.bad_gateway_rate:
+            return Response(502, b"<html>502 Bad Gateway</html>", {"Content-Type": "text/html"})
+
+        parts = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        for route_method, pattern, handler in self.routes:
+            if route_method == method and (match := pattern.fullmatch(parts.path)):
+                return handler(Request(method, parts.path, query, headers, body, match))
+        return Response(404, {"error": f"no route for {method} {parts.path}"})
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True  # avoid delayed-ACK stalls on small responses
+
+            def handle_one_request(self):
+                try:
+                    super().handle_one_request()
+                except ConnectionError:
+                    self.close_connection = True
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                response = server.dispatch((self.command, self.path), dict(self.headers), body)
+                payload = response.body
+                headers = dict(response.headers)
+                if isinstance(payload, Iterator):
+                    self.send_response(response.status)
+                    for k, v in headers.items():
+                        self.send_header(k, v)
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for chunk in payload:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                    return
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload).encode()
+                    headers.setdefault("Content-Type", "application/json")
+                self.send_response(response.status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = _serve
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ---- routes of specific services ----
+
+
+def habitica_routes(user_padding: int = 200_000) -> Routes:
+    """
+    Habitica API v3 (mount with `habitica.BASE_URL = server.url + "/api/v3"`)
+    user_padding: size (bytes) of extra user data, long-lived accounts have big user documents
+    """
+    tasks: dict[str, dict] = {}
+    ids = itertools.count()
+    lock = threading.Lock()
+    user = {"stats": {"hp": 50.0, "gp": 100.0, "exp": 0, "lvl": 1}, "items": {"padding": "x" * user_padding}}
+    tags = {"bot-tag": "bot"}  # id -> name
+
+    def list_tags(request: Request) -> Response:
+        with lock:
+            return Response(body={"success": True, "data": [{"name": n, "id": i} for i, n in tags.items()]})
+
+    def create_tag(request: Request) -> Response:
+        with lock:
+            tag = {"name": request.json()["name"], "id": f"tag-{next(ids)}"}
+            tags[tag["id"]] = tag["name"]
+        return Response(201, {"success": True, "data": tag})
+
+    def delete_tag(request: Request) -> Response:
+        with lock:
+            found = tags.pop(request.match["id"], None)
+        if found is None:
+            return Response(404, {"success": False, "error": "NotFound", "message": "Tag not found."})
+        return Response(body={"success": True, "data": {}})
+
+    def create_task(request: Request) -> Response:
+        with lock:
+            if any(tag not in tags for tag in request.json().get("tags", [])):
+                return Response(404, {"success": False, "error": "NotFound", "message": "Tag not found."})
+            task = {**request.json(), "id": f"task-{next(ids)}"}
+            tasks[task["id"]] = task
+        return Response(201, {"success": True, "data": task})
+
+    def list_tasks(request: Request) -> Response:
+        with lock:
+            return Response(body={"success": True, "data": list(tasks.values())})
+
+    def delete_task(request: Request) -> Response:
+        with lock:
+            found = tasks.pop(request.match["id"], None)
+        if found is None:
+            return Response(404, {"success": False, "error": "NotFound", "message": "Task not found."})
+        return Response(body={"success": True, "data": {}})
+
+    def select(data: dict, fields: str | None) -> dict:
+        if not fields:
+            return data
+        return {k: v for k, v in data.items() if k in fields.split(",")}
+
+    def get_user(request: Request) -> Response:
+        return Response(body={"success": True, "data": select(user, request.query.get("userFields"))})
+
+    def put_user(request: Request) -> Response:
+        with lock:
+            for key, value in request.json().items():
+                section, field = key.split(".", 1)
+                user[section][field] = value
+        return Response(body={"success": True, "data": user})
+
+    return {
+        ("GET", "/api/v3/tags"): list_tags,
+        ("POST", "/api/v3/tags"): create_tag,
+        ("DELETE", r"/api/v3/tags/(?P<id>[^/]+)"): delete_tag,
+        ("POST", "/api/v3/tasks/user"): create_task,
+        ("GET", "/api/v3/tasks/user"): list_tasks,
+        ("DELETE", r"/api/v3/tasks/(?P<id>[^/]+)"): delete_task,
+        ("GET", "/api/v3/user/?"): get_user,
+        ("PUT", "/api/v3/user/?"): put_user,
+    }
+
+
+def smms_routes(total_pages: int = 5, page_size: int = 20) -> Routes:
+    "sm.ms API v2 (mount with `image_host.BASE_URL = server.url + \"/api/v2\"`)"
+    counter = itertools.count()
+
+    def upload(request: Request) -> Response:
+        return Response(body={"success": True, "code": "success", "data": {"url": f"https://i.fake/{next(counter)}.png"}})
+
+    def history(request: Request) -> Response:
+        page = int(parse_qs(request.body.decode()).get("page", ["1"])[0])
+        data = [{"url": f"https://i.fake/{page}-{i}.png"} for i in range(page_size)]
+        return Response(body={"success": True, "data": data, "TotalPages": total_pages, "CurrentPage": page})
+
+    return {("POST", "/api/v2/upload"): upload, ("GET", "/api/v2/upload_history"): history}
+
+
+def iloveimg_routes() -> Routes:
+    """
+    iloveimg API v1 (mount with `image_process.BASE_URL = server.url + "/v1"`)
+    the task server returned by `start` is the fake server itself
+    """
+    uploads: dict[str, bytes] = {}
+    counter = itertools.count()
+
+    def auth(request: Request) -> Response:
+        return Response(body={"token": "signed-token"})
+
+    def start(request: Request) -> Response:
+        return Response(body={"server": request.headers["Host"], "task": f"task-{next(counter)}"})
+
+    def upload(request: Request) -> Response:
+        task = re.search(rb'name="task"\r\n\r\n([^\r]+)', request.body)
+        uploads[task[1].decode() if task else ""] = request.body
+        return Response(body={"server_filename": "server-file"})
+
+    def process(request: Request) -> Response:
+        return Response(body={"download_filename": "filename", "status": "TaskSuccess"})
+
+    def download(request: Request) -> Response:
+        body = uploads.pop(request.match["task"], b"")
+        return Response(body=body[: len(body) // 2], headers={"Content-Type": "image/png"})  # "compressed"
+
+    return {
+        ("POST", "/v1/auth"): auth,
+        ("GET", "/v1/start/compressimage"): start,
+        ("POST", "/v1/upload"): upload,
+        ("POST", "/v1/process"): process,
+        ("GET", r"/v1/download/(?P<task>[^/]+)"): download,
+    }
+
+
+def pushme_routes() -> Routes:
+    "push.i-i.me (mount with `pushme.URL = server.url`)"
+    return {("POST", "/"): lambda request: Response(body=b"success", headers={"Content-Type": "text/plain"})}
+
+
+def notion_routes(depth: int = 3, fanout: int = 5, page_size: int = 100) -> Routes:
+    """
+    Notion API, a block tree of `depth` levels with `fanout` children per block
+    mount with `notion_client.Client(auth=..., base_url=server.url)`
+    """
+
+    def block(block_id: str, level: int) -> dict:
+        return {
+            "object": "block",
+            "id": block_id,
+            "type": "paragraph",
+            "has_children": level < depth,
+            "last_edited_time": "2024-01-01T00:00:00.000Z",
+            "paragraph": {"rich_text": [{"type": "text", "plain_text": block_id, "text": {"content": block_id}}]},
+        }
+
+    def children(request: Request) -> Response:
+        parent = request.match["id"]
+        level = parent.count("-") + 1  # root has level 1, ids are "<root>-i-j..."
+        items = [block(f"{parent}-{i}", level) for i in range(fanout)] if level <= depth else []
+        start = int(request.query.get("start_cursor") or 0)
+        size = min(int(request.query.get("page_size") or page_size), page_size)
+        end = start + size
+        return Response(
+            body={
+                "object": "list",
+                "results": items[start:end],
+                "has_more": end < len(items),
+                "next_cursor": str(end) if end < len(items) else None,
+            }
+        )
+
+    def retrieve(request: Request) -> Response:
+        data = block(request.match["id"], request.match["id"].count("-") + 1)
+        return Response(body={**data, "request_id": "fake"})
+
+    return {
+        ("GET", r"/v1/blocks/(?P<id>[^/]+)/children"): children,
+        ("GET", r"/v1/blocks/(?P<id>[^/]+)"): retrieve,
+        ("GET", r"/v1/pages/(?P<id>[^/]+)"): lambda request: Response(
+            body={"object": "page", "id": request.match["id"], "last_edited_time": "2024-01-01T00:00:00.000Z"}
+        ),
+    }
+
+
+def openai_routes(answer: str = "fake answer " * 20, token_interval: float = 0.0) -> Routes:
+    """
+    OpenAI-compatible chat completions (use `server.url` as base_url)
+    streamed answers (`stream=True`) are sent one word per event, `token_interval` seconds apart
+    """
+
+    def events(model: str) -> Iterator[bytes]:
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            if i and token_interval:
+                time.sleep(token_interval)
+            delta = {"content": word if i == len(words) - 1 else word + " "}
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            yield b"data: " + json.dumps(chunk).encode() + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    def completions(request: Request) -> Response:
+        body = request.json()
+        if body.get("stream"):
+            return Response(200, events(body["model"]), {"Content-Type": "text/event-stream"})
+        return Response(
+            body={
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": len(answer.split()), "total_tokens": 10},
+            }
+        )
+
+    return {("POST", "/chat/completions"): completions}
+
+
+# ---- WebDAV ----
+
+
+class FakeWebDAV(FakeServer):
+    "in-memory WebDAV server, enough for `webdav.JGY`, `ranges=False` ignores Range headers"
+
+    def __init__(
+        self, latency: float = 0.0, username: str = "user", password: str = "password", ranges: bool = True
+    ):
+        self.ranges = ranges
+        self.files: dict[str, bytes] = {}
+        self.dirs: set[str] = {"/"}
+        self.auth = "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()
+        super().__init__({}, latency=latency)
+
+    def dispatch(self, request_line, headers, body):
+        method, target = request_line
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if headers.get("Authorization") != self.auth:
+            return Response(401, b"", {"WWW-Authenticate": 'Basic realm="fake"'})
+        path = unquote(urlsplit(target).path).rstrip("/") or "/"
+        match method:
+            case "PROPFIND":
+                return self._propfind(path)
+            case "MKCOL":
+                self.dirs.add(path)
+                return Response(201, b"")
+            case "PUT":
+                self.files[path] = body
+                return Response(201, b"")
+            case "GET" | "HEAD":
+                if path not in self.files:
+                    return Response(404, b"")
+                return self._get(path, headers)
+            case "DELETE":
+                self.files.pop(path, None)
+                return Response(204, b"")
+        return Response(405, b"")
+
+    def _etag(self, path: str) -> str:
+        return '"' + hashlib.md5(self.files[path]).hexdigest() + '"'
+
+    def _get(self, path: str, headers: dict) -> Response:
+        data = self.files[path]
+        common = {"ETag": self._etag(path), "Accept-Ranges": "bytes"}
+        if_range = headers.get("If-Range")
+        if (
+            self.ranges
+            and if_range in (None, common["ETag"])
+            and (match := re.fullmatch(r"bytes=(\d+)-(\d*)", headers.get("Range", "")))
+        ):
+            start, end = int(match[1]), int(match[2] or len(data) - 1)
+            return Response(206, data[start : end + 1], {**common, "Content-Range": f"bytes {start}-{end}/{len(data)}"})
+        return Response(200, data, common)
+
+    def _propfind(self, path: str) -> Response:
+        if path not in self.dirs and path not in self.files:
+            return Response(404, b"")
+        prefix = path.rstrip("/") + "/"
+        children = [p for p in self.dirs | set(self.files) if p != path and p.startswith(prefix) and "/" not in p[len(prefix) :]]
+        entries = []
+        for p in [path, *children]:
+            name = p.rsplit("/", 1)[-1]
+            if p in self.dirs:
+                props = "<d:resourcetype><d:collection/></d:resourcetype>"
+                href = quote(p.rstrip("/") + "/")
+            else:
+                props = (
+                    f"<d:resourcetype/><d:getcontentlength>{len(self.files[p])}</d:getcontentlength>"
+                    f"<d:getetag>{self._etag(p)}</d:getetag>"
+                )
+                href = quote(p)
+            entries.append(
+                f"<d:response><d:href>{href}</d:href><d:propstat><d:prop>"
+                f"<d:displayname>{name}</d:displayname><d:getlastmodified>{formatdate(usegmt=True)}</d:getlastmodified>"
+                f"{props}</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+            )
+        body = '<?xml version="1.0" encoding="utf-8"?><d:multistatus xmlns:d="DAV:">' + "".join(entries) + "</d:multistatus>"
+        return Response(207, body.encode(), {"Content-Type": "application/xml"})
+
+    def _handler(self):
+        handler = super()._handler()
+        handler.do_PROPFIND = handler.do_MKCOL = handler._serve  # type: ignore[attr-defined]
+        return handler
+
+
+# ---- SMTP ----
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        sink: SMTPSink = self.server.sink  # type: ignore[attr-defined]
+        self.wfile.write(b"220 fake ESMTP\r\n")
+        while line := self.rfile.readline():
+            command = line.decode().strip().upper()
+            if sink.latency:
+                time.sleep(sink.latency)
+            if command.startswith(("EHLO", "HELO")):
+                self.wfile.write(b"250-fake\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif command.startswith("AUTH"):
+                self.wfile.write(b"235 Authentication successful\r\n")
+            elif command == "DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                size = 0
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    size += len(data)
+                sink.received.append(size)
+                self.wfile.write(b"250 OK\r\n")
+            elif command == "QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:  # MAIL FROM, RCPT TO, RSET, NOOP
+                self.wfile.write(b"250 OK\r\n")
+
+
+class SMTPSink:
+    "plain SMTP server accepting every mail, `received` holds the size of each message"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.received: list[int] = []
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+        self._server.daemon_threads = True
+        self._server.sink = self  # type: ignore[attr-defined]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._server.server_address[:2]  # type: ignore[return-value]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# ---- Firestore ----
+
+
+class FakeFirestore:
+    """
+    In-memory stand-in for `firestore.Client` (set `firebase.cfg.db`), `latency` is slept per RPC.
+    Supports documents get/set/update/delete, batches, get_all and on_snapshot.
+    Set FIRESTORE_EMULATOR_HOST and use a real client instead to benchmark against the emulator.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs: dict[str, dict] = {}
+        self.rpcs = 0
+        self._lock = threading.Lock()
+        self._listeners: dict[str, list[Callable]] = {}
+
+    def _rpc(self):
+        self.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name: str) -> "_Collection":
+        return _Collection(self, name)
+
+    def batch(self) -> "_Batch":
+        return _Batch(self)
+
+    def get_all(self, refs, field_paths=None, **kwargs):
+        self._rpc()
+        for ref in refs:
+            yield _Snapshot(ref, self.docs.get(ref.path), field_paths)
+
+    def _apply(self, path: str, data: dict | None, merge: bool = False, update: bool = False):
+        from google.cloud import firestore  # transforms are only used when the firestore extra is installed
+
+        with self._lock:
+            if update and path not in self.docs:
+                raise KeyError(f"document {path} does not exist")
+            if not (merge or update):
+                self.docs[path] = {}
+            doc = self.docs.setdefault(path, {})
+            for key, value in (data or {}).items():
+                if isinstance(value, firestore.ArrayUnion):
+                    current = doc.setdefault(key, [])
+                    current.extend(v for v in value.values if v not in current)
+                elif isinstance(value, firestore.ArrayRemove):
+                    doc[key] = [v for v in doc.get(key, []) if v not in value.values]
+                else:
+                    doc[key] = value
+        self._notify(path)
+
+    def _delete(self, path: str):
+        with self._lock:
+            self.docs.pop(path, None)
+        self._notify(path)
+
+    def _snapshots(self, path: str) -> list["_Snapshot"]:
+        "what a watch sends: only existing documents, an empty list for a missing or deleted one"
+        with self._lock:
+            data = copy.deepcopy(self.docs.get(path))
+        return [] if data is None else [_Snapshot(_Document(self, path), data)]
+
+    def _notify(self, path: str):
+        for callback in list(self._listeners.get(path, [])):
+            callback(self._snapshots(path), [], None)
+
+
+class _Collection:
+    def __init__(self, db: FakeFirestore, name: str):
+        self.db, self.name = db, name
+
+    def document(self, name: str) -> "_Document":
+        return _Document(self.db, f"{self.name}/{name}")
+
+
+class _Document:
+    def __init__(self, db: FakeFirestore, path: str):
+        self.db, self.path = db, path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def get(self):
+        self.db._rpc()
+        return _Snapshot(self, self.db.docs.get(self.path))
+
+    def set(self, data: dict, merge: bool = False):
+        self.db._rpc()
+        self.db._apply(self.path, data, merge=merge)
+
+    def update(self, data: dict):
+        self.db._rpc()
+        self.db._apply(self.path, data, update=True)
+
+    def delete(self):
+        self.db._rpc()
+        self.db._delete(self.path)
+
+    def on_snapshot(self, callback):
+        self.db._listeners.setdefault(self.path, []).append(callback)
+        callback(self.db._snapshots(self.path), [], None)
+        return _Watch(self.db, self.path, callback)
+
+
+class _Watch(NamedTuple):
+    db: FakeFirestore
+    path: str
+    callback: Callable
+
+    def unsubscribe(self):
+        self.db._listeners[self.path].remove(self.callback)
+
+
+class _Snapshot:
+    def __init__(self, reference: _Document, data: dict | None, field_paths=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and field_paths is not None:
+            data = {k: v for k, v in data.items() if k in field_paths}
+        self._data = copy.deepcopy(data)
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class _Batch:
+    def __init__(self, db: FakeFirestore):
+        self.db = db
+        self.ops: list[tuple[str, dict, dict]] = []
+
+    def set(self, ref: _Document, data: dict, merge: bool = False):
+        self.ops.append((ref.path, data, {"merge": merge}))
+
+    def update(self, ref: _Document, data: dict):
+        self.ops.append((ref.path, data, {"update": True}))
+
+    def commit(self):
+        self.db._rpc()
+        for path, data, kwargs in self.ops:
+            self.db._apply(path, data, **kwargs)
@@ -3,11 +3,22 @@ Google Firebase
 - Firestore Database: useful for storing configurations
 """
 
-from google.cloud import firestore
+from __future__ import annotations
+
+import atexit
+import copy
+import functools
+import threading
+import time
+from typing import Callable, Generator, Iterable
+
 from loguru import logger
 
-from .utils import Config
+from . import metrics
+from .utils import Config, LazyImport
 
+firestore = LazyImport("google.cloud.firestore", "firebase")  # imported on first use
+HOST = "firestore.googleapis.com"
 cfg = Config()
 
 
@@ -38,34 +49,396 @@ def init(service_account_info: dict):
     cfg.mark_initialized()
 
 
+MAX_BATCH_SIZE = 500  # Firestore limit of operations per WriteBatch
+GET_ALL_CHUNK_SIZE = 100  # documents per BatchGetDocuments RPC
+
+
+def _merge_field(old, new):
+    "coalesce two writes to the same field, return None if they can't be combined"
+    if isinstance(old, firestore.ArrayUnion) and isinstance(new, firestore.ArrayUnion):
+        return firestore.ArrayUnion(old.values + [v for v in new.values if v not in old.values])
+    if isinstance(old, firestore.ArrayRemove) and isinstance(new, firestore.ArrayRemove):
+        return firestore.ArrayRemove(old.values + [v for v in new.values if v not in old.values])
+    if isinstance(new, (firestore.ArrayUnion, firestore.ArrayRemove)):
+        return None  # array transform after another write, keep the order
+    return new  # later field write overrides earlier one
+
+
+def _overlaps(path: str, other: str) -> bool:
+    "one field path is a parent of the other, eg. 'a' and 'a.b' (can't be in the same update)"
+    return path.startswith(other + ".") or other.startswith(path + ".")
+
+
+class WriteBuffer:
+    """
+    Buffer document writes and commit them as `WriteBatch`es.
+    Updates to the same document are coalesced, flushes happen when `max_ops` is reached,
+    `interval` seconds after the first pending write, or when leaving the context manager.
+    Writes still pending when the interpreter exits are committed by an `atexit` hook.
+    """
+
+    def __init__(self, max_ops: int = MAX_BATCH_SIZE, interval: float | None = 1.0):
+        assert cfg.initialized
+        self.db: firestore.Client = cfg.db
+        self.max_ops = max_ops
+        self.interval = interval
+        self._pending: dict[str, tuple[firestore.DocumentReference, list[dict]]] = {}
+        self._created: set[str] = set()  # documents known to exist
+        self._lock = threading.RLock()
+        self._timer: threading.Timer | None = None
+        atexit.register(self.flush)  # the flush timer is a daemon thread, don't lose the last writes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        "commit pending writes and remove the exit hook"
+        self.flush()
+        atexit.unregister(self.flush)
+
+    @property
+    def size(self) -> int:
+        "number of pending operations (including document creation)"
+        return sum(sum(map(bool, u)) + (path not in self._created) for path, (_, u) in self._pending.items())
+
+    def update(self, doc_ref: firestore.DocumentReference, data: dict):
+        with self._lock:
+            _, updates = self._pending.setdefault(doc_ref.path, (doc_ref, [{}]))
+            last = updates[-1]
+            for key, value in data.items():
+                merged = _merge_field(last[key], value) if key in last else value
+                if merged is None or any(_overlaps(key, k) for k in last):  # start a new update, applied after
+                    last = {}
+                    updates.append(last)
+                    merged = value
+                last[key] = merged
+            if self.size >= self.max_ops:
+                self.flush()
+            else:
+                self._schedule()
+
+    def _schedule(self):
+        "flush pending writes in `interval` seconds, unless a flush is already scheduled"
+        with self._lock:
+            if self.interval is not None and self._timer is None and self._pending:
+                self._timer = threading.Timer(self.interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.exception(f"buffered Firestore writes failed, retrying in {self.interval}s: {e!r}")
+            self._schedule()
+
+    def _restore(self, ops: list):
+        "put uncommitted operations back in front of the pending ones"
+        for doc_ref, data in ops:
+            _, updates = self._pending.setdefault(doc_ref.path, (doc_ref, [{}]))
+            if data is not None:
+                updates.append(data)
+
+    def flush(self):
+        "commit all pending writes, on failure the uncommitted ones stay pending and the error is raised"
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            ops = []
+            for path, (doc_ref, updates) in pending.items():
+                if path not in self._created:
+                    ops.append((doc_ref, None))  # make sure the document exists
+                ops.extend((doc_ref, u) for u in updates if u)
+
+            start = time.perf_counter()
+            committed = 0
+            try:
+                for i in range(0, len(ops), MAX_BATCH_SIZE):
+                    batch = self.db.batch()
+                    for doc_ref, data in ops[i : i + MAX_BATCH_SIZE]:
+                        if data is None:
+                            batch.set(doc_ref, {}, merge=True)
+                        else:
+                            batch.update(doc_ref, data)
+                    with metrics.operation("firebase", "commit", HOST):
+                        batch.commit()
+                    committed = min(i + MAX_BATCH_SIZE, len(ops))
+            except Exception:
+                self._created.update(doc_ref.path for doc_ref, data in ops[:committed] if data is None)
+                self._restore(ops[committed:])
+                raise
+            self._created.update(pending)
+            logger.debug(f"flushed {len(ops)} writes in {time.perf_counter() - start:.3f}s")
+
+
+class DocumentCache:
+    """
+    In-process copies of watched documents, kept current by `on_snapshot` listeners,
+    or by one polling thread reading all documents with a single `get_all` per interval.
+    Shared by all `SimpleDocument`s watching with the same `poll_interval`.
+    """
+
+    def __init__(self, poll_interval: float | None = None):
+        "poll_interval: seconds between polls, None to use snapshot listeners"
+        self.poll_interval = poll_interval
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._poller: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def subscribe(self, doc_ref: firestore.DocumentReference):
+        "start watching a document (reference counted)"
+        with self._lock:
+            if entry := self._entries.get(doc_ref.path):
+                entry["refs"] += 1
+                return
+            entry = {"doc_ref": doc_ref, "data": None, "ready": threading.Event(), "callbacks": [], "refs": 1}
+            self._entries[doc_ref.path] = entry
+            if self.poll_interval is None:
+                entry["watch"] = doc_ref.on_snapshot(functools.partial(self._on_snapshot, doc_ref.path))
+            elif self._poller is None:
+                self._stop = threading.Event()  # a stopped poller keeps its own (set) event
+                self._poller = threading.Thread(target=self._poll, daemon=True)
+                self._poller.start()
+
+    def unsubscribe(self, doc_ref: firestore.DocumentReference):
+        with self._lock:
+            entry = self._entries.get(doc_ref.path)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+            del self._entries[doc_ref.path]
+            if watch := entry.get("watch"):
+                watch.unsubscribe()
+            if not self._entries and self._poller is not None:
+                self._stop.set()
+                self._poller = None
+
+    def add_callback(self, doc_ref: firestore.DocumentReference, callback: Callable[[dict], None]):
+        self._entries[doc_ref.path]["callbacks"].append(callback)
+
+    def remove_callback(self, doc_ref: firestore.DocumentReference, callback: Callable[[dict], None]):
+        if entry := self._entries.get(doc_ref.path):
+            entry["callbacks"].remove(callback)
+
+    def get(self, doc_ref: firestore.DocumentReference, timeout: float | None = 10) -> dict:
+        "return a copy of the cached document, wait for the first snapshot if needed"
+        entry = self._entries[doc_ref.path]
+        if not entry["ready"].wait(timeout):
+            raise TimeoutError(f"no snapshot received for {doc_ref.path}")
+        return copy.deepcopy(entry["data"])
+
+    def _set(self, path: str, data: dict):
+        entry = self._entries.get(path)
+        if entry is None or entry["data"] == data:
+            return
+        initial = not entry["ready"].is_set()
+        entry["data"] = data
+        entry["ready"].set()
+        if initial:
+            return
+        for callback in list(entry["callbacks"]):
+            try:
+                callback(copy.deepcopy(data))
+            except Exception as e:
+                logger.exception(e)
+
+    def _on_snapshot(self, path: str, snapshots, changes, read_time):
+        # the watch only sends existing documents: no snapshot means missing or deleted
+        for snapshot in snapshots:
+            if snapshot.reference.path == path and snapshot.exists:
+                self._set(path, snapshot.to_dict() or {})
+                return
+        self._set(path, {})
+
+    def _poll(self):
+        stop = self._stop
+        while True:
+            with self._lock:
+                refs = [e["doc_ref"] for e in self._entries.values()]
+            if refs:
+                try:
+                    with metrics.operation("firebase", "get_all", HOST):
+                        snapshots = list(cfg.db.get_all(refs))
+                    for snapshot in snapshots:
+                        self._set(snapshot.reference.path, snapshot.to_dict() or {})
+                except Exception as e:
+                    logger.exception(e)
+            if stop.wait(self.poll_interval):
+                return
+
+
+_caches: dict[float | None, DocumentCache] = {}
+
+
+def document_cache(poll_interval: float | None = None) -> DocumentCache:
+    "shared document cache for the given poll interval (None for snapshot listeners)"
+    if poll_interval not in _caches:
+        _caches[poll_interval] = DocumentCache(poll_interval)
+    return _caches[poll_interval]
+
+
 class SimpleDocument:
-    def __init__(self, collection: str, document: str):
+    def __init__(
+        self,
+        collection: str,
+        document: str,
+        buffer: WriteBuffer | None = None,
+        live: bool = False,
+        poll_interval: float | None = None,
+    ):
+        """
+        the document is created on the first write (not on construction)
+        buffer: if set, writes are buffered and committed in batches
+        live: serve `get` from an in-process copy kept current by a snapshot listener
+        poll_interval: with `live`, poll every `poll_interval` seconds instead of listening
+        """
         assert cfg.initialized
         db: firestore.Client = cfg.db
         doc_ref: firestore.DocumentReference = db.collection(collection).document(
             document
         )
-        doc_ref.set({}, merge=True)  # make sure the document exists
 
         self.db = db
         self.doc_ref = doc_ref
+        self.buffer = buffer
+        self._created = False
+        self.cache = document_cache(poll_interval) if live else None
+        self._callbacks: list[Callable[[dict], None]] = []
+        if self.cache is not None:
+            self.cache.subscribe(doc_ref)
 
     def get(self):
-        return self.doc_ref.get().to_dict()
+        if self.cache is not None:
+            return self.cache.get(self.doc_ref)
+        with metrics.operation("firebase", "get", HOST):
+            snapshot = self.doc_ref.get()
+        return snapshot.to_dict() or {}
+
+    def on_change(self, callback: Callable[[dict], None]):
+        "register a callback called with the new document data on each change (live mode only)"
+        assert self.cache is not None, "on_change requires live=True"
+        self.cache.add_callback(self.doc_ref, callback)
+        self._callbacks.append(callback)
+
+    def close(self):
+        "stop watching the document (live mode only)"
+        if self.cache is not None:
+            for callback in self._callbacks:
+                self.cache.remove_callback(self.doc_ref, callback)
+            self.cache.unsubscribe(self.doc_ref)
+            self.cache = None
+            self._callbacks = []
+
+    def _write(self, data: dict):
+        if self.buffer is not None:
+            self.buffer.update(self.doc_ref, data)
+        elif self._created:
+            with metrics.operation("firebase", "update", HOST):
+                self.doc_ref.update(data)
+        else:  # create and update within one commit
+            batch = self.db.batch()
+            batch.set(self.doc_ref, {}, merge=True)  # make sure the document exists
+            batch.update(self.doc_ref, data)
+            with metrics.operation("firebase", "commit", HOST):
+                batch.commit()
+            self._created = True
 
     def update(self, **data):
-        self.doc_ref.update(data)
+        self._write(data)
 
     def insert_array(self, key: str, array: list):
         "more efficient way to insert element to an array"
-        self.doc_ref.update({key: firestore.ArrayUnion(array)})
+        self._write({key: firestore.ArrayUnion(array)})
 
     def remove_array(self, key: str, array: list):
         "more efficient way to remove element from an array"
-        self.doc_ref.update({key: firestore.ArrayRemove(array)})
+        self._write({key: firestore.ArrayRemove(array)})
 
 
 @cfg.check_initialized
-def request_document(collection: str, document: str):
-    "get a document reference, create if it doesn't exist"
-    return SimpleDocument(collection, document)
+def request_document(
+    collection: str,
+    document: str,
+    buffer: WriteBuffer | None = None,
+    live: bool = False,
+    poll_interval: float | None = None,
+):
+    "get a document reference, the document is created on first write if it doesn't exist"
+    return SimpleDocument(collection, document, buffer, live, poll_interval)
+
+
+@cfg.check_initialized
+def write_buffer(max_ops: int = MAX_BATCH_SIZE, interval: float | None = 1.0) -> WriteBuffer:
+    """
+    create a write buffer, use it as a context manager to flush on exit:
+    ```
+    with firebase.write_buffer() as buffer:
+        doc = firebase.request_document("config", "app", buffer=buffer)
+        doc.update(a=1)
+        doc.update(b=2)  # committed together with a=1
+    ```
+    """
+    return WriteBuffer(max_ops, interval)
+
+
+@cfg.check_initialized
+def get_many(
+    collection: str,
+    ids: Iterable[str],
+    fields: list[str] | None = None,
+    chunk_size: int = GET_ALL_CHUNK_SIZE,
+) -> Generator[tuple[str, dict | None], None, None]:
+    """
+    read many documents with batched `get_all` RPCs, yield (id, data) lazily
+    data is None if the document does not exist
+    fields: only read these fields (projection), default all
+    """
+    db: firestore.Client = cfg.db
+    col = db.collection(collection)
+    ids = list(ids)
+    for i in range(0, len(ids), chunk_size):
+        refs = [col.document(id) for id in ids[i : i + chunk_size]]
+        with metrics.operation("firebase", "get_all", HOST):
+            snapshots = list(db.get_all(refs, field_paths=fields))
+        for snapshot in snapshots:
+            yield snapshot.id, snapshot.to_dict() if snapshot.exists else None
+
+
+@cfg.check_initialized
+def stream_collection(
+    collection: str,
+    fields: list[str] | None = None,
+    page_size: int = 300,
+) -> Generator[tuple[str, dict], None, None]:
+    """
+    stream all documents in a collection page by page, yield (id, data) lazily
+    fields: only read these fields (projection), default all
+    page_size: documents per query, bounds memory of each page
+    """
+    db: firestore.Client = cfg.db
+    query = db.collection(collection).order_by("__name__")  # document id, stable pagination
+    if fields is not None:
+        query = query.select(fields)
+    last = None
+    while True:
+        page = query.limit(page_size)
+        if last is not None:
+            page = page.start_after(last)
+        with metrics.operation("firebase", "stream", HOST):
+            snapshots = list(page.stream())  # one page, bounded by page_size
+        for snapshot in snapshots:
+            last = snapshot
+            yield snapshot.id, snapshot.to_dict() or {}
+        if len(snapshots) < page_size:
+            return
@@ -1,14 +1,34 @@
+import copy
+import hashlib
+import importlib
+import threading
 import time
-from functools import lru_cache
-from typing import NamedTuple
+from typing import TYPE_CHECKING, Any, Iterable, NamedTuple
 
 import requests
 from loguru import logger
 
+from . import metrics
 from .utils import Config
 
+if TYPE_CHECKING:
+    from .outbox import Outbox
+
+BASE_URL = "https://habitica.com/api/v3"
+USER_MAX_AGE = 60.0  # seconds cached user data is used without refetching
 cfg = Config()
 
+_lock = threading.Lock()
+_bot_tag: str | None = None
+_user: dict[str, tuple[float, Any]] = {}  # top-level user field -> (monotonic time received, value)
+
+
+def __getattr__(name: str):
+    "`habitica.aio`: asyncio counterparts, imported on first access"
+    if name == "aio":
+        return importlib.import_module(".aio.habitica", __package__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def init(user: str, key: str):
     """
@@ -22,44 +42,77 @@ def init(user: str, key: str):
         "x-api-key": key,
         "content-type": "application/json",
     }
+    clear_cache()
     cfg.mark_initialized()
 
 
-def _check(response):
-    "check response result and catch rate limit, return status code"
+def clear_cache():
+    "forget the cached bot tag and user data"
+    global _bot_tag
+    with _lock:
+        _bot_tag = None
+        _user.clear()
+
+
+def _classify(response) -> tuple[str, float]:
+    "check response result and catch rate limit, return status code and seconds to wait before retry"
     try:
         # 某些未知情况下 response.json() 会报错，所以这里谨慎一些 (可能是因为 502，返回的是 html)
         if response.status_code == 429:
             retry_after = float(response.headers["Retry-After"])
             logger.warning(f"rate limit exceeded, sleep {retry_after}s")
-            time.sleep(retry_after)
-            return "TooManyRequests"
+            return "TooManyRequests", retry_after
         if response.status_code == 502:  # bad gateway
             logger.warning("502 Bad Gateway, sleep 1s")
-            time.sleep(1)
-            return "BadGateway"
+            return "BadGateway", 1
+        if response.status_code == 404:  # eg. a deleted task or tag
+            logger.warning(f"NotFound: {response.text}")
+            return "NotFound", 0
         if response.json()["success"]:
-            return "Success"
+            return "Success", 0
     except Exception as e:
         logger.exception(e)
     logger.error(f"UnknownError: {response.status_code=}, {response.text=}")
-    return "UnknownError"
+    return "UnknownError", 0
 
 
-@cfg.check_initialized
-@lru_cache
-def get_bot_tag() -> str:
-    """return uuid of 'bot' tag"""
-    url = "https://habitica.com/api/v3/tags"
-    payload = None
-    response = requests.get(url, data=payload, headers=cfg.headers)
-    tags = response.json()["data"]
+def _check(response):
+    "check response result and catch rate limit, return status code"
+    result, wait = _classify(response)
+    if wait:
+        metrics.sleep(wait)
+    return result
+
+
+def _bot_tag_id(tags: list[dict]) -> str:
+    "remember and return the id of the 'bot' tag"
+    global _bot_tag
     for tag in tags:
         if tag["name"] == "bot":
-            return tag["id"]
+            _bot_tag = tag["id"]
+            return _bot_tag
     raise Exception("bot tag does not exist!")
 
 
+def _invalidate_bot_tag():
+    "the cached tag may have been deleted, fetch it again next time"
+    global _bot_tag
+    _bot_tag = None
+
+
+@cfg.check_initialized
+def get_bot_tag() -> str:
+    """return uuid of 'bot' tag (cached until a request returns NotFound)"""
+    if _bot_tag is not None:
+        return _bot_tag
+    url = f"{BASE_URL}/tags"
+    payload = None
+    with metrics.operation("habitica", "get_tags") as call:
+        response = requests.get(url, data=payload, headers=cfg.headers)
+        call.observe(response)
+    return _bot_tag_id(response.json()["data"])
+
+
 class Task(NamedTuple):
     text: str
     notes: str
@@ -67,14 +120,44 @@ class Task(NamedTuple):
 
 
 @cfg.check_initialized
-def create_tasks(tasks: list[Task]):
+def create_task(text: str, notes: str, type: str = "todo") -> dict:
+    "create one bot task, raise if it fails (used to replay outbox entries)"
+    payload = {"text": text, "type": type, "notes": notes, "tags": [get_bot_tag()]}
+    with metrics.operation("habitica", "create_task") as call:
+        response = requests.post(f"{BASE_URL}/tasks/user", json=payload, headers=cfg.headers)
+        call.observe(response)
+        if (result := _check(response)) == "NotFound":  # the bot tag may have been recreated
+            _invalidate_bot_tag()
+            payload["tags"] = [get_bot_tag()]
+            call.retries += 1
+            response = requests.post(f"{BASE_URL}/tasks/user", json=payload, headers=cfg.headers)
+            call.observe(response)
+            result = _check(response)
+    if result != "Success":
+        raise Exception(f"failed to create task {text!r} ({result})")
+    return response.json()["data"]
+
+
+@cfg.check_initialized
+def delete_task(task_id: str) -> None:
+    "delete one task, raise if it fails, a missing task counts as deleted (used to replay outbox entries)"
+    with metrics.operation("habitica", "delete_task") as call:
+        response = requests.delete(f"{BASE_URL}/tasks/{task_id}", headers=cfg.headers)
+        call.observe(response)
+    if response.status_code != 404 and (result := _check(response)) != "Success":
+        raise Exception(f"failed to delete task {task_id} ({result})")
+
+
+@cfg.check_initialized
+def create_tasks(tasks: list[Task], outbox: "Outbox | None" = None):
     """
     create a list of tasks
     return tasks that failed to create
+    outbox: if set, failed tasks are also enqueued to be created later
     """
     failed: list[Task] = []
 
-    url = "https://habitica.com/api/v3/tasks/user"
+    url = f"{BASE_URL}/tasks/user"
     bot_tag = get_bot_tag()
     logger.debug(f"create {len(tasks)} task")
     for task in tasks:
@@ -84,61 +167,131 @@ def create_tasks(tasks: list[Task]):
             "notes": task.notes,
             "tags": [bot_tag],  # indicate that the task is created by a bot
         }
-        response = requests.post(url, json=payload, headers=cfg.headers)
-        result = _check(response)
-        if result != "Success":  # retry
+        with metrics.operation("habitica", "create_task") as call:
             response = requests.post(url, json=payload, headers=cfg.headers)
+            call.observe(response)
             result = _check(response)
+            if result != "Success":  # retry
+                if result == "NotFound":  # the bot tag may have been recreated
+                    _invalidate_bot_tag()
+                    payload["tags"] = [bot_tag := get_bot_tag()]
+                call.retries += 1
+                response = requests.post(url, json=payload, headers=cfg.headers)
+                call.observe(response)
+                result = _check(response)
         if result != "Success":
             logger.error(f"{task} created failed ({result})")
             failed.append(task)
+            if outbox is not None:
+                key = "habitica.create_task:" + hashlib.sha1(repr(tuple(task)).encode()).hexdigest()
+                outbox.enqueue(
+                    "integrations.habitica:create_task", key=key, wait=True, text=task.text, notes=task.notes, type=task.type
+                )
     return failed
 
 
 @cfg.check_initialized
-def delete_bot_tasks():
-    "delete bot tasks, return tasks that failed to delete"
+def delete_bot_tasks(outbox: "Outbox | None" = None):
+    """
+    delete bot tasks, return tasks that failed to delete
+    outbox: if set, failed deletions are also enqueued to be retried later
+    """
     failed = []
 
     bot_tag = get_bot_tag()
     # get all tasks
-    url = "https://habitica.com/api/v3/tasks/user"
+    url = f"{BASE_URL}/tasks/user"
     payload = {"type": "todos"}  # 不知道为什么不起作用
-    response = requests.get(url, json=payload, headers=cfg.headers)
+    with metrics.operation("habitica", "get_tasks") as call:
+        response = requests.get(url, json=payload, headers=cfg.headers)
+        call.observe(response)
     tasks = list(filter(lambda t: bot_tag in t["tags"] and t["type"] == "todo", response.json()["data"]))
     logger.debug(f"delete {len(tasks)} task")
     for t in tasks:
-        url = f"https://habitica.com/api/v3/tasks/{t['id']}"
-        response = requests.delete(url, headers=cfg.headers)
-        result = _check(response)
-        if result != "Success":  # retry
+        url = f"{BASE_URL}/tasks/{t['id']}"
+        with metrics.operation("habitica", "delete_task") as call:
             response = requests.delete(url, headers=cfg.headers)
+            call.observe(response)
             result = _check(response)
+            if result != "Success":  # retry
+                call.retries += 1
+                response = requests.delete(url, headers=cfg.headers)
+                call.observe(response)
+                result = _check(response)
         if result != "Success":
             logger.error(f"Failed to delete task {t}. ({result})")
             failed.append(t)
+            if outbox is not None:
+                key = f"habitica.delete_task:{t['id']}"
+                outbox.enqueue("integrations.habitica:delete_task", key=key, wait=True, task_id=t["id"])
     return failed
 
 
+def _cached_user(fields: list[str], max_age: float) -> tuple[dict, list[str]]:
+    "cached user fields received within `max_age` seconds, and the missing ones"
+    now = time.monotonic()
+    with _lock:
+        cached = {f: copy.deepcopy(_user[f][1]) for f in fields if f in _user and now - _user[f][0] <= max_age}
+    return cached, [f for f in fields if f not in cached]
+
+
+def _store_user(data: dict):
+    "cache user fields from a response (GET with userFields, or the user returned by PUT)"
+    now = time.monotonic()
+    with _lock:
+        for field, value in data.items():
+            _user[field] = (now, value)
+
+
+def _user_fields(user: dict, fields: list[str]) -> dict:
+    return {f: copy.deepcopy(user[f]) for f in fields if f in user}
+
+
 @cfg.check_initialized
-def get_user_stats() -> dict:
-    url = "https://habitica.com/api/v3/user/"
-    response = requests.get(url, headers=cfg.headers)
-    stats = response.json()["data"]["stats"]
-    return stats
+def get_user(fields: Iterable[str] = ("stats",), max_age: float = USER_MAX_AGE) -> dict:
+    """
+    user data restricted to top-level `fields` (eg. "stats", "items"), the whole document can be hundreds of KB
+    only fields not cached within `max_age` seconds are requested (`max_age=0` to always refetch)
+    """
+    fields = list(fields)
+    user, missing = _cached_user(fields, max_age)
+    if missing:
+        url = f"{BASE_URL}/user/"
+        with metrics.operation("habitica", "get_user") as call:
+            response = requests.get(url, params={"userFields": ",".join(missing)}, headers=cfg.headers)
+            call.observe(response)
+        data = response.json()["data"]
+        _store_user(data)
+        user.update(_user_fields(data, missing))
+    return user
 
 
 @cfg.check_initialized
-def lose_gp(amount: int) -> float:
-    "lose gold coins, return current gold coins"
-    stats = get_user_stats()
+def get_user_stats(max_age: float = USER_MAX_AGE) -> dict:
+    "user stats (hp, gp, exp, ...), see `get_user` for `max_age`"
+    return get_user(["stats"], max_age)["stats"]
+
+
+@cfg.check_initialized
+def lose_gp(amount: int, max_age: float = 0) -> float:
+    """
+    lose gold coins, return current gold coins
+    gp / hp are set to absolute values, so stats are read fresh (only the `stats` field) by default.
+    max_age: reuse stats cached within that many seconds, eg. for a batch of adjustments where nothing
+        else changes gold meanwhile: one request instead of two
+    """
+    stats = get_user_stats(max_age)
     target_hp = stats["hp"]
     target_gp = stats["gp"] - amount
     if target_gp < 0:  # lose hp when gp is not enough
         target_hp = max(0, target_hp + target_gp)
         target_gp = 0
 
-    url = "https://habitica.com/api/v3/user/"
+    url = f"{BASE_URL}/user/"
     payload = {"stats.gp": target_gp, "stats.hp": target_hp}
-    response = requests.put(url, json=payload, headers=cfg.headers)
-    return response.json()["data"]["stats"]["gp"]
+    with metrics.operation("habitica", "update_user") as call:
+        response = requests.put(url, json=payload, headers=cfg.headers)
+        call.observe(response)
+    user = response.json()["data"]  # the updated user
+    _store_user(user)
+    return user["stats"]["gp"]
@@ -1,15 +1,25 @@
 "sm.ms image host"
+import importlib
 from io import BytesIO
 from os.path import exists
 from typing import Generator
 
 import requests
 
+from . import metrics
 from .utils import Config
 
+BASE_URL = "https://sm.ms/api/v2"
 cfg = Config()
 
 
+def __getattr__(name: str):
+    "`image_host.aio`: asyncio counterparts, imported on first access"
+    if name == "aio":
+        return importlib.import_module(".aio.image_host", __package__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def init(token: str) -> None:
     """token: your sm.ms token"""
     global cfg
@@ -39,7 +49,9 @@ def upload_image(source: str | BytesIO | bytes, name: str, bucket: str = "img")
     # set image name
     image.name = f"{bucket}-{name}"
     files = {"smfile": image}
-    response = requests.post("https://sm.ms/api/v2/upload", files=files, headers=cfg.headers)
+    with metrics.operation("image_host", "upload") as call:
+        response = requests.post(f"{BASE_URL}/upload", files=files, headers=cfg.headers)
+        call.observe(response)
 
     res = response.json()
     match res["code"]:
@@ -55,12 +67,18 @@ def upload_image(source: str | BytesIO | bytes, name: str, bucket: str = "img")
 @cfg.check_initialized
 def image_list() -> Generator[dict, None, None]:
     "get all uploaded images"
-    url = "https://sm.ms/api/v2/upload_history"
+    url = f"{BASE_URL}/upload_history"
     payload = {"page": 1}
-    res = requests.get(url, data=payload, headers=cfg.headers).json()
+    with metrics.operation("image_host", "upload_history") as call:
+        response = requests.get(url, data=payload, headers=cfg.headers)
+        call.observe(response)
+    res = response.json()
     yield from res["data"]
 
     for i in range(2, res["TotalPages"] + 1):
         payload["page"] = i
-        res = requests.get(url, data=payload, headers=cfg.headers).json()
+        with metrics.operation("image_host", "upload_history") as call:
+            response = requests.get(url, data=payload, headers=cfg.headers)
+            call.observe(response)
+        res = response.json()
         yield from res["data"]
@@ -1,16 +1,27 @@
 "image process based on https://www.iloveimg.com/"
+import importlib
 from io import BytesIO
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import requests
 from cachetools import TTLCache, cached
 from loguru import logger
 
+from . import metrics
 from .utils import Config
 
+BASE_URL = "https://api.iloveimg.com/v1"
 cfg = Config()
 
 
+def __getattr__(name: str):
+    "`image_process.aio`: asyncio counterparts, imported on first access"
+    if name == "aio":
+        return importlib.import_module(".aio.image_process", __package__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def init(public_key: str):
     "public_key: iloveimg public key"
     cfg.public_key = public_key
@@ -19,11 +30,13 @@ def init(public_key: str):
 
 @cached(cache=TTLCache(maxsize=10, ttl=3600))  # signed tokens expire after 2 hours
 def request_signed_token(public_key: str):
-    url = "https://api.iloveimg.com/v1/auth"
+    url = f"{BASE_URL}/auth"
     payload = {"public_key": public_key}
     headers = {"content-type": "application/json"}
 
-    response = requests.post(url, json=payload, headers=headers)
+    with metrics.operation("image_process", "auth") as call:
+        response = requests.post(url, json=payload, headers=headers)
+        call.observe(response)
     token = response.json()["token"]
     return token
 
@@ -40,34 +53,46 @@ def compress_image(image: bytes, ext=".png") -> bytes:
 
     # step1: start
     logger.debug("start compress image")
-    res = requests.get("https://api.iloveimg.com/v1/start/compressimage", headers=headers).json()
+    with metrics.operation("image_process", "start") as call:
+        response = requests.get(f"{BASE_URL}/start/compressimage", headers=headers)
+        call.observe(response)
+    res = response.json()
     server, task = res["server"], res["task"]
+    server = f"{urlsplit(BASE_URL).scheme}://{server}"  # assigned server shares the api scheme
 
     # step2: upload
     logger.debug("upload image")
-    res = requests.post(
-        f"https://{server}/v1/upload",
-        headers=headers,
-        files={"file": ("filename" + ext, BytesIO(image))},  # here specify a filename, not important
-        data={"task": task},
-    ).json()
+    with metrics.operation("image_process", "upload") as call:
+        response = requests.post(
+            f"{server}/v1/upload",
+            headers=headers,
+            files={"file": ("filename" + ext, BytesIO(image))},  # here specify a filename, not important
+            data={"task": task},
+        )
+        call.observe(response)
+    res = response.json()
     server_filename = res["server_filename"]
 
     # step3: process
     logger.debug("process image")
-    url = f"https://{server}/v1/process"
+    url = f"{server}/v1/process"
     data = {
         "task": task,
         "tool": "compressimage",
         "files": [{"server_filename": server_filename, "filename": "filename" + ext}],  # filename should match above
     }
-    res = requests.post(url, headers=headers, json=data).json()
+    with metrics.operation("image_process", "process") as call:
+        response = requests.post(url, headers=headers, json=data)
+        call.observe(response)
+    res = response.json()
     # download_filename = res["download_filename"]  # by default, it is the same as file.name
 
     # step4: download
     logger.debug("download image")
-    url = f"https://{server}/v1/download/{task}"
-    response = requests.get(url, headers=headers)
+    url = f"{server}/v1/download/{task}"
+    with metrics.operation("image_process", "download") as call:
+        response = requests.get(url, headers=headers)
+        call.observe(response)
     response.raise_for_status()  # 检查请求是否成功
     return response.content
 
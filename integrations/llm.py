@@ -1,13 +1,34 @@
+import asyncio
+import functools
+import importlib
 import re
+import statistics
+import threading
 import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, NamedTuple
+from urllib.parse import urlsplit
 
-from openai import OpenAI, RateLimitError
+from loguru import logger
 
-from .utils import Config
+from . import metrics
+from .utils import Config, LazyImport
 
+openai = LazyImport("openai", "llm")  # imported on first use
+MOONSHOT_BASE_URL = "https://api.moonshot.cn/v1"
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
 cfg = Config()
 
 
+def __getattr__(name: str):
+    "`llm.aio`: asyncio counterparts, imported on first access"
+    if name == "aio":
+        return importlib.import_module(".aio.llm", __package__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def init(api_key: str):
     """
     key: moonshot ai api key
@@ -17,29 +38,96 @@ def init(api_key: str):
     cfg.mark_initialized()
 
 
+def _retry_after(e: Exception) -> float | None:
+    "seconds to wait before retrying a rate limited request, None if it should not be retried"
+    match_res = re.search(r"try again after (\d+) seconds", e.body["message"])
+    if not match_res:
+        return None
+    # the retry_after time is not accurate, use 60s instead
+    retry_after = 60
+    print(f"reched rate time limit, sleep {retry_after} seconds")
+    return retry_after
+
+
 def retry_wrapper(func):
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
-        except RateLimitError as e:
-            match_res = re.search(r"try again after (\d+) seconds", e.body["message"])
-            if not match_res:
+        except openai.RateLimitError as e:
+            retry_after = _retry_after(e)
+            if retry_after is None:
                 raise e
-            # the retry_after time is not accurate, use 60s instead
-            retry_after = 60
-            print(f"reched rate time limit, sleep {retry_after} seconds")
-            time.sleep(retry_after)
+            metrics.sleep(retry_after)
+            metrics.add_retry()
             return func(*args, **kwargs)
 
     return wrapper
 
 
+@functools.lru_cache(maxsize=None)
+def _client(api_key: str, base_url: str, max_retries: int | None = None):
+    "shared client per endpoint: it pools connections, and creating one (ssl context) takes tens of ms"
+    if max_retries is None:
+        return openai.OpenAI(api_key=api_key, base_url=base_url)
+    return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+
+
+def _messages(query: str, role: str) -> list[dict]:
+    return [
+        {"role": "system", "content": role},
+        {"role": "user", "content": query},
+    ]
+
+
+def _delta(chunk, call: metrics.Call) -> str:
+    "text of a streamed chunk, counting output tokens on the call"
+    content = chunk.choices[0].delta.content if chunk.choices else None
+    if content:
+        call.output_tokens += 1  # about one token per chunk
+    if getattr(chunk, "usage", None) is not None:  # sent with the last chunk by some providers
+        call.output_tokens = chunk.usage.completion_tokens
+    return content or ""
+
+
+def _stream(client, operation: str, **kwargs) -> Iterator[str]:
+    """
+    yield text deltas of a streamed completion
+    a rate limit error is raised before the first token, it is retried once like `retry_wrapper`
+    """
+    call = metrics.Call("llm", operation, urlsplit(str(client.base_url)).netloc)
+    start = time.perf_counter()
+    try:
+        try:
+            stream = client.chat.completions.create(stream=True, **kwargs)
+        except openai.RateLimitError as e:
+            retry_after = _retry_after(e)
+            if retry_after is None:
+                raise e
+            call.rate_limit_sleep += retry_after
+            call.retries += 1
+            time.sleep(retry_after)
+            stream = client.chat.completions.create(stream=True, **kwargs)
+        with stream:
+            for chunk in stream:
+                if delta := _delta(chunk, call):
+                    if not call.time_to_first_token:
+                        call.time_to_first_token = time.perf_counter() - start
+                    yield delta
+    except Exception as e:
+        call.status = type(e).__name__
+        raise
+    finally:
+        call.latency = time.perf_counter() - start
+        metrics.record(call)
+
+
 @cfg.check_initialized
+@metrics.traced("llm", "ask_moonshot", urlsplit(MOONSHOT_BASE_URL).netloc)
 @retry_wrapper
 def ask_moonshot(query: str, role: str) -> str:
-    client = OpenAI(
+    client = _client(
         api_key=cfg.api_key,
-        base_url="https://api.moonshot.cn/v1",
+        base_url=MOONSHOT_BASE_URL,
         max_retries=0,  # no retry, it makes harder to handle rate limit error
     )
     completion = client.chat.completions.create(
@@ -54,11 +142,12 @@ def ask_moonshot(query: str, role: str) -> str:
 
 
 @cfg.check_initialized
+@metrics.traced("llm", "ask_deepseek", urlsplit(DEEPSEEK_BASE_URL).netloc)
 @retry_wrapper
 def ask_deepseek(query: str, role: str) -> str:
-    client = OpenAI(
+    client = _client(
         api_key=cfg.api_key,
-        base_url="https://api.deepseek.com",
+        base_url=DEEPSEEK_BASE_URL,
     )
     response = client.chat.completions.create(
         model="deepseek-chat",
@@ -71,3 +160,468 @@ def ask_deepseek(query: str, role: str) -> str:
         stream=False,
     )
     return response.choices[0].message.content
+
+
+@cfg.check_initialized
+def stream_moonshot(query: str, role: str) -> Iterator[str]:
+    "like `ask_moonshot`, but yield the answer's text as it arrives"
+    client = _client(
+        api_key=cfg.api_key,
+        base_url=MOONSHOT_BASE_URL,
+        max_retries=0,  # no retry, it makes harder to handle rate limit error
+    )
+    return _stream(
+        client, "stream_moonshot", model="moonshot-v1-8k", messages=_messages(query, role), temperature=0.6
+    )
+
+
+@cfg.check_initialized
+def stream_deepseek(query: str, role: str) -> Iterator[str]:
+    "like `ask_deepseek`, but yield the answer's text as it arrives"
+    client = _client(
+        api_key=cfg.api_key,
+        base_url=DEEPSEEK_BASE_URL,
+    )
+    return _stream(
+        client,
+        "stream_deepseek",
+        model="deepseek-chat",
+        messages=_messages(query, role),
+        max_tokens=1024,
+        temperature=0.7,
+    )
+
+
+# ---- multi-provider router ----
+
+
+class Provider(NamedTuple):
+    "an OpenAI-compatible chat completions endpoint"
+
+    name: str
+    base_url: str
+    api_key: str
+    model: str
+    options: dict = {}  # extra arguments of `chat.completions.create`, eg. {"temperature": 0.6}
+
+
+class _Stats:
+    "rolling latencies and errors of a provider"
+
+    def __init__(self, window: int):
+        self.latencies: deque[float] = deque(maxlen=window)  # successful requests only
+        self.errors: deque[tuple[float, bool]] = deque(maxlen=window)  # (monotonic time, failed)
+        self.cooldown_until = 0.0  # monotonic time, set on rate limit errors
+
+    def quantile(self, q: float) -> float | None:
+        if not self.latencies:
+            return None
+        if len(self.latencies) == 1:
+            return self.latencies[0]
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[round(q * 100) - 1]
+
+    def error_rate(self, since: float = 0.0) -> float:
+        "error rate of the requests made after `since` (monotonic time)"
+        recent = [failed for t, failed in self.errors if t >= since]
+        return sum(recent) / len(recent) if recent else 0.0
+
+
+class Router:
+    """
+    Send each request to the fastest healthy provider (rolling median latency), fail over to the next on errors.
+
+    ```
+    router = llm.Router([
+        llm.Provider("deepseek", llm.DEEPSEEK_BASE_URL, key1, "deepseek-chat", {"max_tokens": 1024}),
+        llm.Provider("moonshot", llm.MOONSHOT_BASE_URL, key2, "moonshot-v1-8k"),
+    ], hedge=True)
+    answer = router.ask(query, role)  # or `await router.aask(query, role)`
+    ```
+
+    hedge: if the provider has not answered within its p95 latency (`hedge_after` until `min_samples`
+        are known), also send the request to the next one, the first answer wins and the other is cancelled
+        (`ask` can't interrupt a running request: the loser finishes in background, its latency still counts)
+    window: number of recent requests the latency and error rate are computed on
+    max_error_rate / cooldown: a provider is unhealthy above this error rate, or for `cooldown` seconds
+        after a rate limit error, it is only used when every provider is unhealthy;
+        errors older than `cooldown` are forgotten, so a demoted provider is probed again after that
+    concurrency: expected concurrent `ask` callers when hedging (eg. `map_reduce(concurrency=...)`),
+        sizes the hedging thread pool
+    """
+
+    def __init__(
+        self,
+        providers: list[Provider],
+        hedge: bool = False,
+        hedge_after: float = 2.0,
+        min_samples: int = 5,
+        window: int = 50,
+        max_error_rate: float = 0.5,
+        cooldown: float = 60.0,
+        timeout: float = 60.0,
+        concurrency: int = 16,
+    ):
+        assert providers, "at least one provider is required"
+        assert len({p.name for p in providers}) == len(providers), "provider names must be unique"
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._stats = {p.name: _Stats(window) for p in providers}
+        self._lock = threading.Lock()
+        self._clients: dict[str, object] = {}
+        self._aclients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()  # event loop -> {name: client}
+        self._executor: ThreadPoolExecutor | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        "stop hedging threads and close the sync clients (async clients are closed with their event loop)"
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+
+    # ---- stats ----
+
+    def ranked(self) -> list[Provider]:
+        "providers from the best to the worst: healthy ones by median latency (unknown first), then the others"
+        now = time.monotonic()
+
+        def key(provider: Provider):
+            s = self._stats[provider.name]
+            healthy = now >= s.cooldown_until and s.error_rate(now - self.cooldown) <= self.max_error_rate
+            return (not healthy, s.quantile(0.5) or 0.0)
+
+        with self._lock:
+            return sorted(self.providers, key=key)
+
+    def stats(self) -> dict[str, dict]:
+        "rolling p50 / p95 latency (seconds), recent error rate and rate limit cooldown of each provider"
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    "p50": s.quantile(0.5),
+                    "p95": s.quantile(0.95),
+                    "error_rate": s.error_rate(now - self.cooldown),
+                    "cooling_down": now < s.cooldown_until,
+                    "requests": len(s.errors),
+                }
+                for name, s in self._stats.items()
+            }
+
+    def _deadline(self, provider: Provider) -> float:
+        "seconds to wait for the provider before hedging"
+        with self._lock:
+            s = self._stats[provider.name]
+            if len(s.latencies) < self.min_samples:
+                return self.hedge_after
+            return s.quantile(0.95)
+
+    def _record(self, provider: Provider, latency: float, error: Exception | None):
+        with self._lock:
+            s = self._stats[provider.name]
+            now = time.monotonic()
+            s.errors.append((now, error is not None))
+            if error is None:
+                s.latencies.append(latency)
+            elif isinstance(error, openai.RateLimitError):
+                s.cooldown_until = now + self.cooldown
+
+    # ---- sync ----
+
+    def _client(self, provider: Provider):
+        with self._lock:
+            if provider.name not in self._clients:
+                self._clients[provider.name] = openai.OpenAI(
+                    api_key=provider.api_key, base_url=provider.base_url, max_retries=0, timeout=self.timeout
+                )
+            return self._clients[provider.name]
+
+    def _call(
+        self, provider: Provider, messages: list[dict], operation: str, started: threading.Event | None = None
+    ) -> str:
+        if started is not None:
+            started.set()
+        client = self._client(provider)
+        start = time.perf_counter()
+        try:
+            with metrics.operation("llm", operation, urlsplit(provider.base_url).netloc):
+                completion = client.chat.completions.create(
+                    model=provider.model, messages=messages, **provider.options
+                )
+        except Exception as e:
+            self._record(provider, time.perf_counter() - start, e)
+            raise
+        self._record(provider, time.perf_counter() - start, None)
+        return completion.choices[0].message.content
+
+    def ask(self, query: str, role: str) -> str:
+        "answer from the best provider, raise the last error if every provider failed"
+        messages = _messages(query, role)
+        candidates = self.ranked()
+        if self.hedge and len(candidates) > 1:
+            return self._ask_hedged(candidates, messages)
+        error = None
+        for provider in candidates:
+            try:
+                return self._call(provider, messages, "router")
+            except openai.APIError as e:
+                logger.warning(f"llm provider {provider.name} failed: {e!r}")
+                error = e
+        raise error
+
+    def _ask_hedged(self, candidates: list[Provider], messages: list[dict]) -> str:
+        with self._lock:
+            if self._executor is None:  # a primary and a backup per caller, losers may run a bit longer
+                self._executor = ThreadPoolExecutor(max_workers=2 * self.concurrency + len(self.providers))
+            executor = self._executor
+        primary, backups = candidates[0], candidates[1:]
+        started = threading.Event()
+        pending = {executor.submit(self._call, primary, messages, "router", started): primary}
+        started.wait()  # time queued in the pool doesn't count against the deadline
+        timeout = self._deadline(primary)
+        error = None
+        while pending:
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    answer = future.result()
+                except openai.APIError as e:
+                    logger.warning(f"llm provider {provider.name} failed: {e!r}")
+                    error = e
+                else:
+                    for loser in pending:
+                        loser.cancel()  # no effect once running
+                    return answer
+            if backups and (not done or not pending):  # deadline passed, or every request failed
+                provider = backups.pop(0)
+                pending[executor.submit(self._call, provider, messages, "router.hedge")] = provider
+                timeout = self._deadline(provider)
+            elif not backups:
+                timeout = None
+        raise error
+
+    # ---- async ----
+
+    def _aclient(self, provider: Provider):
+        clients = self._aclients.setdefault(asyncio.get_running_loop(), {})
+        if provider.name not in clients:
+            clients[provider.name] = openai.AsyncOpenAI(
+                api_key=provider.api_key, base_url=provider.base_url, max_retries=0, timeout=self.timeout
+            )
+        return clients[provider.name]
+
+    async def _acall(self, provider: Provider, messages: list[dict], operation: str) -> str:
+        client = self._aclient(provider)
+        start = time.perf_counter()
+        try:
+            with metrics.operation("llm", operation, urlsplit(provider.base_url).netloc):
+                completion = await client.chat.completions.create(
+                    model=provider.model, messages=messages, **provider.options
+                )
+        except Exception as e:  # a cancelled request (hedging loser) is not recorded
+            self._record(provider, time.perf_counter() - start, e)
+            raise
+        self._record(provider, time.perf_counter() - start, None)
+        return completion.choices[0].message.content
+
+    async def aask(self, query: str, role: str) -> str:
+        "async `ask`, a hedging loser is cancelled"
+        messages = _messages(query, role)
+        candidates = self.ranked()
+        if not self.hedge:
+            error = None
+            for provider in candidates:
+                try:
+                    return await self._acall(provider, messages, "router")
+                except openai.APIError as e:
+                    logger.warning(f"llm provider {provider.name} failed: {e!r}")
+                    error = e
+            raise error
+
+        primary, backups = candidates[0], candidates[1:]
+        pending = {asyncio.ensure_future(self._acall(primary, messages, "router")): primary}
+        timeout = self._deadline(primary) if backups else None
+        error = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except openai.APIError as e:
+                        logger.warning(f"llm provider {provider.name} failed: {e!r}")
+                        error = e
+                if backups and (not done or not pending):  # deadline passed, or every request failed
+                    provider = backups.pop(0)
+                    pending[asyncio.ensure_future(self._acall(provider, messages, "router.hedge"))] = provider
+                    timeout = self._deadline(provider)
+                elif not backups:
+                    timeout = None
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# ---- long inputs ----
+
+_CJK = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+SEPARATOR = "\n\n---\n\n"  # between partial results given to the reduce prompt
+
+
+def estimate_tokens(text: str) -> int:
+    "local token count estimate: one per CJK character, one per 4 other characters (errs on the high side)"
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _char_tokens(char: str) -> float:
+    return 1.0 if _CJK.match(char) else 0.25
+
+
+def _hard_split(text: str, max_tokens: int) -> list[str]:
+    "cut text without usable boundaries into pieces of at most `max_tokens`"
+    pieces, start, size = [], 0, 0.0
+    for i, char in enumerate(text):
+        n = _char_tokens(char)
+        if size + n > max_tokens:
+            pieces.append(text[start:i])
+            start, size = i, 0.0
+        size += n
+    pieces.append(text[start:])
+    return pieces
+
+
+def _units(text: str, max_tokens: int) -> list[str]:
+    "split text into paragraphs, sentences if needed, each at most `max_tokens`, joining them gives back the text"
+    units = []
+    for paragraph in re.split(r"(?<=\n\n)", text):
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?;\n。！？；])", paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+            else:
+                units += _hard_split(sentence, max_tokens)
+    return [unit for unit in units if unit]
+
+
+def _tail(text: str, tokens: int) -> str:
+    "end of the text worth about `tokens` tokens"
+    size = 0.0
+    for i in range(len(text) - 1, -1, -1):
+        size += _char_tokens(text[i])
+        if size > tokens:
+            return text[i + 1 :]
+    return text
+
+
+def split_text(text: str, max_tokens: int = 3000, overlap: int = 200) -> list[str]:
+    """
+    split text into chunks of at most `max_tokens` (estimated), on paragraph or sentence boundaries when possible
+    overlap: tokens of the end of a chunk repeated at the start of the next one, to keep context across cuts
+    """
+    assert 0 <= overlap < max_tokens, "overlap must be smaller than max_tokens"
+    chunks: list[str] = []
+    current: list[str] = []
+    size, fresh = 0, False  # fresh: current has more than the overlap of the previous chunk
+    for unit in _units(text, max_tokens - overlap):
+        n = estimate_tokens(unit)
+        if fresh and size + n > max_tokens:
+            chunks.append("".join(current))
+            tail = _tail(chunks[-1], overlap) if overlap else ""
+            current, size = [tail], estimate_tokens(tail)
+        current.append(unit)
+        size += n
+        fresh = True
+    if fresh:
+        chunks.append("".join(current))
+    return chunks
+
+
+class _Pacer:
+    "space calls at least 60 / `per_minute` seconds apart, across threads"
+
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute
+        self.next = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next)
+            self.next = at + self.interval
+        if at > now:
+            metrics.sleep(at - now)
+
+
+def _groups(results: list[str], max_tokens: int, fan_in: int) -> list[list[str]]:
+    "group partial results for one reduce level, at least two per group so every level shrinks"
+    groups: list[list[str]] = []
+    size = 0
+    for result in results:
+        n = estimate_tokens(result)
+        if groups and (len(groups[-1]) < 2 or len(groups[-1]) < fan_in and size + n <= max_tokens):
+            groups[-1].append(result)
+            size += n
+        else:
+            groups.append([result])
+            size = n
+    return groups
+
+
+def map_reduce(
+    text: str,
+    map_prompt: str,
+    reduce_prompt: str,
+    ask=None,
+    max_tokens: int = 3000,
+    overlap: int = 200,
+    concurrency: int = 4,
+    requests_per_minute: float | None = None,
+    fan_in: int = 8,
+) -> str:
+    """
+    Answer over a text longer than the model's context:
+    the text is split into chunks (`split_text`), `ask(chunk, map_prompt)` runs on the chunks concurrently,
+    then partial results are combined with `ask(results, reduce_prompt)` level by level (at most `fan_in`
+    results / `max_tokens` per request) until one is left. A text fitting in one chunk is only mapped.
+
+    ask: `ask_moonshot` (default), `ask_deepseek`, `Router(...).ask` (with the same `concurrency`),
+        or any `(query, role) -> str`
+    max_tokens: estimated tokens per request, leave room for the prompt and the answer in the context
+    concurrency / requests_per_minute: requests in flight / started per minute, keep them under the provider's limits
+    """
+    ask = ask or ask_moonshot
+    pacer = _Pacer(requests_per_minute) if requests_per_minute else None
+
+    def paced(query: str, role: str) -> str:
+        if pacer is not None:
+            pacer.wait()
+        return ask(query, role)
+
+    chunks = split_text(text, max_tokens, overlap)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda chunk: paced(chunk, map_prompt), chunks))
+        while len(results) > 1:
+            groups = _groups(results, max_tokens, fan_in)
+            results = list(executor.map(lambda group: paced(SEPARATOR.join(group), reduce_prompt), groups))
+    return results[0] if results else ""
@@ -1,18 +1,23 @@
 from email.mime.text import MIMEText
-from smtplib import SMTP_SSL, SMTPException
-from typing import List, NamedTuple
+from smtplib import SMTP, SMTP_SSL, SMTPException
+from typing import TYPE_CHECKING, List, NamedTuple
 
+from . import metrics
 from .utils import Config
 
+if TYPE_CHECKING:
+    from .outbox import Outbox
+
 cfg = Config()
 
 
-def init(send_server: str, send_port: int, user: str, password: str):
+def init(send_server: str, send_port: int, user: str, password: str, use_ssl: bool = True):
     """
     send_server: smtp server address, eg. "smtp.qq.com"
     send_port: smtp server port, eg. 465
     user: email address, eg. "xxx@qq.com"
     password: email password
+    use_ssl: connect with SMTP over SSL, set False for a plain SMTP server (eg. local relay)
     """
     global cfg
     cfg.update(
@@ -21,19 +26,37 @@ def init(send_server: str, send_port: int, user: str, password: str):
             "SEND_PORT": send_port,
             "USER": user,
             "PASSWORD": password,
+            "USE_SSL": use_ssl,
         }
     )
     cfg.mark_initialized()
 
 
 @cfg.check_initialized
-def send_mail(subject: str, message: str, to: List[str], msg_type="plain"):
+def send_mail(subject: str, message: str, to: List[str], msg_type="plain", outbox: "Outbox | None" = None):
     """
     to: list of email address send to, must be valid. (you may use `[mail.cfg.USER]`)
     msg_type: "html" or "plain"
+    outbox: if set, a mail that can't be sent (SMTP or connection error) is enqueued to be sent later
     """
     try:
-        with SMTP_SSL(host=cfg.SEND_SERVER, port=cfg.SEND_PORT) as smtp:
+        _send(subject, message, to, msg_type)
+    except OSError as e:  # SMTPException is an OSError too
+        if outbox is None and not isinstance(e, SMTPException):
+            raise
+        print("send mail failed:", e)
+        if outbox is not None:
+            outbox.enqueue(
+                "integrations.mail:_send", wait=True, subject=subject, message=message, to=to, msg_type=msg_type
+            )
+
+
+@cfg.check_initialized
+def _send(subject: str, message: str, to: List[str], msg_type="plain"):
+    "send a mail, raise on failure (used to replay outbox entries)"
+    smtp_class = SMTP_SSL if cfg.USE_SSL else SMTP
+    with metrics.operation("mail", "send_mail", f"{cfg.SEND_SERVER}:{cfg.SEND_PORT}") as call:
+        with smtp_class(host=cfg.SEND_SERVER, port=cfg.SEND_PORT) as smtp:
             msg = MIMEText(message, msg_type, _charset="utf-8")
             msg["Subject"] = subject
             msg["From"] = cfg.USER
@@ -43,7 +66,8 @@ def send_mail(subject: str, message: str, to: List[str], msg_type="plain"):
             smtp.login(
                 user=cfg.USER, password=cfg.PASSWORD
             )  # (235, b'Authentication successful')
-            smtp.sendmail(from_addr=cfg.USER, to_addrs=to, msg=msg.as_string())
+            content = msg.as_string()
+            smtp.sendmail(from_addr=cfg.USER, to_addrs=to, msg=content)
+            call.bytes_sent += len(content.encode())
+            call.status = "250"
             smtp.quit()  # 结束会话
-    except SMTPException as e:  # 捕获SMTP异常
-        print("send mail failed:", e)
@@ -0,0 +1,343 @@
+"""
+Metrics and tracing hooks for outbound calls of all integrations.
+
+Every outbound call records module, operation, host, status, bytes sent / received,
+latency, retry count and time spent sleeping on rate limits (plus time to first token and
+output tokens for streamed LLM answers), and hands it to the registered sinks:
+
+```
+from integrations import metrics
+
+sink = metrics.add_sink(metrics.PrometheusSink())
+...
+print(sink.exposition())
+```
+
+Nothing is recorded (and almost no work is done) while no sink is registered.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Protocol
+from urllib.parse import urlsplit
+
+from .utils import LazyImport
+
+otel_trace = LazyImport("opentelemetry.trace", "otel")  # imported on first use
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+
+
+@dataclass
+class Call:
+    "one outbound call, filled in while it runs"
+
+    module: str
+    operation: str
+    host: str = ""
+    status: str = ""
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    latency: float = 0.0
+    retries: int = 0
+    rate_limit_sleep: float = 0.0
+    time_to_first_token: float = 0.0  # streamed responses only
+    output_tokens: int = 0  # streamed responses only
+    start_time: int = field(default_factory=time.time_ns)  # unix ns, for tracing
+
+    @property
+    def tokens_per_second(self) -> float:
+        "output tokens per second once the first token arrived"
+        generation = self.latency - self.time_to_first_token
+        return self.output_tokens / generation if self.output_tokens and generation > 0 else 0.0
+
+    def observe(self, response) -> None:
+        "take host, status and sizes from a (non-streamed) `requests.Response` or `httpx.Response`"
+        self.host = urlsplit(str(response.url)).netloc
+        self.status = str(response.status_code)
+        request = response.request
+        body = request.body if hasattr(request, "body") else request.content  # requests / httpx
+        self.bytes_sent += len(body) if body else 0
+        length = response.headers.get("Content-Length")
+        self.bytes_received += int(length) if length else len(response.content)
+
+
+class Sink(Protocol):
+    def record(self, call: Call) -> None: ...
+
+
+_sinks: list[Sink] = []
+_current: contextvars.ContextVar[Call | None] = contextvars.ContextVar("integrations_call", default=None)
+
+
+def add_sink(sink):
+    "register a sink receiving every finished call, return it"
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink) -> None:
+    _sinks.remove(sink)
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+class _Operation:
+    "context manager measuring one call, yields the `Call` to fill in"
+
+    __slots__ = ("call", "token", "start")
+
+    def __init__(self, module: str, operation: str, host: str):
+        self.call = Call(module, operation, host)
+
+    def __enter__(self) -> Call:
+        self.token = _current.set(self.call)
+        self.start = time.perf_counter()
+        return self.call
+
+    def __exit__(self, exc_type, exc, tb):
+        call = self.call
+        call.latency = time.perf_counter() - self.start
+        _current.reset(self.token)
+        if not call.status:
+            call.status = "ok" if exc_type is None else exc_type.__name__
+        for sink in list(_sinks):
+            sink.record(call)
+
+
+class _Disabled:
+    "shared no-op stand-in for `_Operation` and `Call` while no sink is registered"
+
+    __slots__ = ()
+    host = status = ""
+    bytes_sent = bytes_received = retries = output_tokens = 0
+    latency = rate_limit_sleep = time_to_first_token = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+    def observe(self, response) -> None:
+        pass
+
+
+_DISABLED = _Disabled()
+
+
+def operation(module: str, operation: str, host: str = ""):
+    """
+    measure an outbound call:
+    ```
+    with metrics.operation("pushme", "push") as call:
+        response = requests.post(url, json=data)
+        call.observe(response)
+    ```
+    """
+    if not _sinks:
+        return _DISABLED
+    return _Operation(module, operation, host)
+
+
+def record(call: Call) -> None:
+    "hand a call measured by hand (eg. a streamed response, see `llm.stream_moonshot`) to the sinks"
+    if not _sinks:
+        return
+    call.status = call.status or "ok"
+    for sink in list(_sinks):
+        sink.record(call)
+
+
+def traced(module: str, operation_name: str, host: str = ""):
+    "decorator measuring each call of the function as one outbound call"
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+            with _Operation(module, operation_name, host):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def sleep(seconds: float) -> None:
+    "time.sleep for rate limits, accounted to the running call"
+    if (call := _current.get()) is not None:
+        call.rate_limit_sleep += seconds
+    time.sleep(seconds)
+
+
+async def asleep(seconds: float) -> None:
+    "asyncio.sleep for rate limits, accounted to the running call"
+    if (call := _current.get()) is not None:
+        call.rate_limit_sleep += seconds
+    await asyncio.sleep(seconds)
+
+
+def add_retry() -> None:
+    "count a retry of the running call"
+    if (call := _current.get()) is not None:
+        call.retries += 1
+
+
+# ---- sinks ----
+
+
+class InMemorySink:
+    "latency histograms and counters per (module, operation, host, status)"
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.series: dict[tuple[str, str, str, str], dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, call: Call) -> None:
+        key = (call.module, call.operation, call.host, call.status)
+        with self._lock:
+            s = self.series.get(key)
+            if s is None:
+                s = self.series[key] = {
+                    "count": 0,
+                    "latency_sum": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),  # last one is +Inf
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "retries": 0,
+                    "rate_limit_sleep": 0.0,
+                    "time_to_first_token": 0.0,
+                    "output_tokens": 0,
+                    "generation_seconds": 0.0,
+                }
+            s["count"] += 1
+            s["latency_sum"] += call.latency
+            s["buckets"][bisect.bisect_left(self.buckets, call.latency)] += 1
+            s["bytes_sent"] += call.bytes_sent
+            s["bytes_received"] += call.bytes_received
+            s["retries"] += call.retries
+            s["rate_limit_sleep"] += call.rate_limit_sleep
+            if call.output_tokens:
+                s["time_to_first_token"] += call.time_to_first_token
+                s["output_tokens"] += call.output_tokens
+                s["generation_seconds"] += call.latency - call.time_to_first_token
+
+    def quantile(self, q: float, module: str, operation: str | None = None) -> float:
+        "estimate latency quantile (upper bucket bound) over matching series"
+        counts = [0] * (len(self.buckets) + 1)
+        with self._lock:
+            for (m, o, _, _), s in self.series.items():
+                if m == module and operation in (None, o):
+                    counts = [a + b for a, b in zip(counts, s["buckets"])]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        seen = 0
+        for bound, count in zip((*self.buckets, float("inf")), counts):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float("inf")
+
+    def clear(self) -> None:
+        with self._lock:
+            self.series.clear()
+
+
+class PrometheusSink(InMemorySink):
+    "`InMemorySink` rendered in the Prometheus text exposition format"
+
+    prefix = "integrations"
+
+    def exposition(self) -> str:
+        lines = []
+        counters = [
+            ("bytes_sent_total", "bytes_sent", "Request bytes sent."),
+            ("bytes_received_total", "bytes_received", "Response bytes received."),
+            ("retries_total", "retries", "Retried requests."),
+            ("rate_limit_sleep_seconds_total", "rate_limit_sleep", "Time slept waiting for rate limits."),
+            ("time_to_first_token_seconds_total", "time_to_first_token", "Time waiting for the first streamed token."),
+            ("output_tokens_total", "output_tokens", "Streamed output tokens."),
+            ("generation_seconds_total", "generation_seconds", "Time streaming output tokens after the first."),
+        ]
+        with self._lock:
+            series = {k: {**v, "buckets": list(v["buckets"])} for k, v in self.series.items()}
+
+        name = f"{self.prefix}_call_duration_seconds"
+        lines += [f"# HELP {name} Outbound call latency.", f"# TYPE {name} histogram"]
+        for key, s in series.items():
+            labels = _labels(key)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), s["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {s['latency_sum']}")
+            lines.append(f"{name}_count{{{labels}}} {s['count']}")
+
+        for suffix, field_name, help in counters:
+            name = f"{self.prefix}_{suffix}"
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+            lines += [f"{name}{{{_labels(key)}}} {s[field_name]}" for key, s in series.items()]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: tuple[str, str, str, str]) -> str:
+    names = ("module", "operation", "host", "status")
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, key))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _is_error(status: str) -> bool:
+    "4xx / 5xx codes and exception names are errors, 'ok' and other codes are not"
+    if status.isdigit():
+        return status.startswith(("4", "5"))
+    return status not in ("", "ok")
+
+
+class OpenTelemetrySink:
+    "emit each call as an OpenTelemetry span (requires `opentelemetry-api`)"
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer or otel_trace.get_tracer("integrations")
+
+    def record(self, call: Call) -> None:
+        span = self.tracer.start_span(f"{call.module}.{call.operation}", start_time=call.start_time)
+        span.set_attributes(
+            {
+                "integrations.module": call.module,
+                "integrations.operation": call.operation,
+                "server.address": call.host,
+                "integrations.status": call.status,
+                "integrations.bytes_sent": call.bytes_sent,
+                "integrations.bytes_received": call.bytes_received,
+                "integrations.retries": call.retries,
+                "integrations.rate_limit_sleep": call.rate_limit_sleep,
+            }
+        )
+        if call.output_tokens:
+            span.set_attributes(
+                {
+                    "integrations.time_to_first_token": call.time_to_first_token,
+                    "integrations.output_tokens": call.output_tokens,
+                    "integrations.tokens_per_second": call.tokens_per_second,
+                }
+            )
+        if _is_error(call.status):
+            span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, call.status))
+        span.end(end_time=call.start_time + int(call.latency * 1e9))
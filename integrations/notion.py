@@ -3,11 +3,19 @@
 """
 
 import html
+import json
 import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
 from typing import Any, Callable, Generator, Iterable
 
-import notion_client
-from notion_client.helpers import extract_notion_id
+from . import metrics
+from .utils import LazyImport
+
+notion_client = LazyImport("notion_client", "notion")  # imported on first use
+HOST = "api.notion.com"
 
 
 def init(token: str) -> None:
@@ -19,6 +27,13 @@ def init(token: str) -> None:
     client = notion_client.Client(auth=token)
 
 
+def __getattr__(name: str):
+    "keep `extract_notion_id` importable from here without importing notion_client eagerly"
+    if name == "extract_notion_id":
+        return notion_client.helpers.extract_notion_id
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def require_client(func):
     def wrapper(*args, **kwargs):
         if "client" not in globals():
@@ -61,8 +76,10 @@ def iterate_retrieve(
     """
     next_cursor = kwargs.pop("start_cursor", None)
 
+    operation = getattr(function, "__qualname__", "iterate_retrieve")
     while True:
-        response = function(**kwargs, start_cursor=next_cursor)
+        with metrics.operation("notion", operation, HOST):
+            response = function(**kwargs, start_cursor=next_cursor)
         yield from response.get("results", [])
 
         next_cursor = response.get("next_cursor")
@@ -71,6 +88,7 @@ def iterate_retrieve(
 
 
 @require_client
+@metrics.traced("notion", "blocks.retrieve", HOST)
 def retrieve_general_info(id: str):
     """
     retrieve general info from id, useful for checking type: page, database, blocks...
@@ -83,6 +101,7 @@ def retrieve_general_info(id: str):
 
 
 @require_client
+@metrics.traced("notion", "pages.retrieve", HOST)
 def retrieve_page(page_id: str) -> dict:
     "retrieve a page by id"
     return client.pages.retrieve(page_id)  # type: ignore
@@ -150,20 +169,87 @@ def retrieve_block_children(
     )
 
 
+class BlockCache:
+    """
+    Persistent cache (sqlite) of children lists, each stored with its parent block's `last_edited_time`.
+    A children list is reused while the parent's `last_edited_time` is unchanged, so an unchanged subtree
+    is served from disk, and an unchanged page (Notion bumps a page's time on any edit inside) costs one request.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS children ("
+            " block_id TEXT PRIMARY KEY, last_edited_time TEXT NOT NULL, fetched REAL NOT NULL, children TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, block_id: str, last_edited_time: str) -> list[dict] | None:
+        "cached children of the block, None if missing or stale"
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_edited_time, fetched, children FROM children WHERE block_id = ?", (block_id,)
+            ).fetchone()
+        if row is None or row[0] != last_edited_time:
+            return None
+        # last_edited_time is rounded to the minute, a list fetched during that minute may miss later edits
+        edited = datetime.fromisoformat(last_edited_time.replace("Z", "+00:00")).timestamp()
+        if row[1] < edited + 60:
+            return None
+        return json.loads(row[2])
+
+    def put(self, block_id: str, last_edited_time: str, children: list[dict], fetched: float | None = None):
+        "store the children of the block, `fetched`: time the request was sent (default now)"
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO children VALUES (?, ?, ?, ?)",
+                (block_id, last_edited_time, fetched or time.time(), json.dumps(children)),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM children")
+
+    def close(self):
+        self._db.close()
+
+
 @require_client
 def retrieve_block_children_recursive(
-    block_id: str, **kwargs
+    block_id: str, cache: BlockCache | None = None, **kwargs
 ) -> Generator[dict, None, None]:
     """
     retrieve children blocks inside a page.
     retrieve_all: if True, try to retrieve all pages by performing query in a loop.
+    cache: reuse children lists of blocks not edited since they were cached,
+        costs one extra request (the root block) per call, unchanged pages cost only that one
     """
     # TODO: use `limit` instead of `page_size` to avoid confusion with Notion API's page_size
 
-    ids = [block_id]
     limit = int(kwargs["page_size"]) if "page_size" in kwargs else float("inf")
-    for i in ids:
-        for block in retrieve_block_children(i, **kwargs):
+
+    def children(block: dict) -> Iterable[dict]:
+        if cache is None:
+            return retrieve_block_children(block["id"], **kwargs)
+        cached = cache.get(block["id"], block["last_edited_time"])
+        if cached is None:
+            fetched = time.time()
+            complete = {k: v for k, v in kwargs.items() if k != "page_size"}  # cached lists must be complete
+            cached = list(retrieve_block_children(block["id"], **complete))
+            cache.put(block["id"], block["last_edited_time"], cached, fetched)
+        return cached
+
+    blocks = [retrieve_general_info(block_id) if cache is not None else {"id": block_id}]
+    for parent in blocks:
+        for block in children(parent):
             yield block
 
             limit -= 1
@@ -171,10 +257,11 @@ def retrieve_block_children_recursive(
                 return
 
             if block["has_children"]:
-                ids.append(block["id"])
+                blocks.append(block)
 
 
 @require_client
+@metrics.traced("notion", "pages.create", HOST)
 def create_data_source_page(data_source_id: str, properties: dict = {}) -> dict:
     "create a new empty page inside a data source, return the created page"
     # properties must be specified (`{}` for empty)
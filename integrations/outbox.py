@@ -0,0 +1,267 @@
+"""
+Durable local outbox for failed or deferred outbound operations, backed by SQLite.
+
+An entry is a call `target(**payload)`, `target` being "module:function", eg. "integrations.pushme:push".
+Entries are buffered and committed in batches (one fsync per batch), a background drainer
+replays due entries with exponential backoff until they succeed or run out of attempts.
+Due entries are claimed (leased) before being replayed, so several drainers, threads or processes
+sharing the database don't deliver the same entry twice.
+
+```
+from integrations import outbox, pushme
+
+with outbox.Outbox("outbox.db") as box:
+    pushme.push("title", "content", outbox=box)  # enqueued instead of raising if the push fails
+    box.enqueue("integrations.pushme:push", title="deferred", content="sent by the drainer")
+
+# in a long-running process (call the modules' `init` first)
+box = outbox.Outbox("outbox.db")
+box.start()  # replay in background
+```
+Entries still buffered when the interpreter exits are committed by an `atexit` hook.
+"""
+
+import atexit
+import importlib
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable
+
+from loguru import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    target TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | inflight | done | dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,  -- for inflight entries: when the claim expires
+    created REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_due ON entries (status, next_attempt);
+CREATE UNIQUE INDEX IF NOT EXISTS entries_open_key ON entries (key) WHERE status IN ('pending', 'inflight');
+"""
+
+# databases created when keys were unique across all entries (delivered ones included)
+MIGRATE_UNIQUE_KEY = f"""
+BEGIN;
+DROP INDEX IF EXISTS entries_due;
+ALTER TABLE entries RENAME TO entries_old;
+{SCHEMA}
+INSERT INTO entries SELECT * FROM entries_old;
+DROP TABLE entries_old;
+COMMIT;
+"""
+
+
+def resolve(target: str) -> Callable[..., Any]:
+    "import the function of a 'module:function' target"
+    module, _, name = target.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class Outbox:
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 1000,
+        flush_interval: float | None = 0.05,
+        max_attempts: int = 10,
+        backoff: float = 1.0,
+        max_backoff: float = 3600.0,
+        lease: float = 300.0,
+    ):
+        """
+        path: sqlite database file
+        batch_size / flush_interval: enqueued entries are committed together when `batch_size` is reached
+            or `flush_interval` seconds after the first one (None: only on `flush`, `close` or batch size)
+        max_attempts: entries failing that many times are marked 'dead'
+        backoff / max_backoff: retry delay is `backoff * 2 ** attempts` (with jitter), capped at `max_backoff`
+        lease: claimed entries not settled within `lease` seconds (eg. the drainer crashed) are replayed again
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # a commit is durable
+        table = self._db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'entries'").fetchone()
+        self._db.executescript(MIGRATE_UNIQUE_KEY if table and "key TEXT NOT NULL UNIQUE" in table[0] else SCHEMA)
+        self._lock = threading.RLock()
+        self._pending: list[tuple] = []
+        self._timer: threading.Timer | None = None
+        self._drainer: threading.Thread | None = None
+        self._stop = threading.Event()
+        atexit.register(self.flush)  # the flush timer is a daemon thread, don't lose the last batch
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- enqueue ----
+
+    def enqueue(self, target: str, key: str | None = None, wait: bool = False, **payload) -> str:
+        """
+        add `target(**payload)` to the outbox, return its idempotency key
+        key: idempotency key, ignored while an entry with the same key is waiting to be delivered
+        wait: commit before returning, otherwise it is committed with the next batch
+        """
+        key = key or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._pending.append((key, target, json.dumps(payload), now, now))
+            if wait or len(self._pending) >= self.batch_size:
+                self.flush()
+            elif self.flush_interval is not None and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        return key
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.exception(f"outbox flush failed, entries kept for the next flush: {e!r}")
+
+    def flush(self):
+        "commit enqueued entries in one transaction, on failure they stay enqueued and the error is raised"
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO entries (key, target, payload, next_attempt, created) VALUES (?, ?, ?, ?, ?)",
+                    pending,
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                self._pending[:0] = pending
+                raise
+
+    # ---- drain ----
+
+    def _claim(self, limit: int) -> list[tuple]:
+        "lease due entries (and entries whose claim expired) to this drainer in one write transaction"
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")  # other processes can't claim the same rows in between
+            try:
+                rows = self._db.execute(
+                    "SELECT id, target, payload, attempts FROM entries"
+                    " WHERE status IN ('pending', 'inflight') AND next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE entries SET status = 'inflight', next_attempt = ? WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows],
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def drain(self, limit: int = 100) -> int:
+        "claim and replay due entries once, return the number delivered"
+        self.flush()
+        rows = self._claim(limit)
+
+        delivered = 0
+        for id, target, payload, attempts in rows:
+            try:
+                resolve(target)(**json.loads(payload))
+            except Exception as e:
+                attempts += 1
+                status = "dead" if attempts >= self.max_attempts else "pending"
+                delay = min(self.max_backoff, self.backoff * 2**attempts) * random.uniform(0.5, 1.0)
+                logger.warning(f"outbox entry {id} ({target}) failed {attempts} times: {e!r}")
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE entries SET status = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                        (status, attempts, time.time() + delay, repr(e), id),
+                    )
+            else:
+                delivered += 1
+                with self._lock:
+                    self._db.execute("UPDATE entries SET status = 'done', attempts = ? WHERE id = ?", (attempts + 1, id))
+        return delivered
+
+    def start(self, interval: float = 1.0):
+        "replay due entries in a background thread every `interval` seconds"
+        if self._drainer is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    if self.drain():
+                        continue  # more entries may be due
+                except Exception as e:
+                    logger.exception(e)
+                self._stop.wait(interval)
+
+        self._drainer = threading.Thread(target=run, daemon=True)
+        self._drainer.start()
+
+    def stop(self):
+        if self._drainer is not None:
+            self._stop.set()
+            self._drainer.join()
+            self._drainer = None
+
+    def close(self):
+        "stop the drainer, commit enqueued entries and close the database"
+        self.stop()
+        self.flush()
+        atexit.unregister(self.flush)
+        self._db.close()
+
+    # ---- inspect ----
+
+    def count(self, status: str = "pending") -> int:
+        "number of entries with `status` (pending, inflight, done or dead)"
+        self.flush()
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries WHERE status = ?", (status,)).fetchone()[0]
+
+    def dead(self) -> list[dict]:
+        "entries that ran out of attempts"
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, target, payload, attempts, last_error FROM entries WHERE status = 'dead'"
+            ).fetchall()
+        return [
+            {"key": k, "target": t, "payload": json.loads(p), "attempts": a, "last_error": e} for k, t, p, a, e in rows
+        ]
+
+    def prune(self, older_than: float = 7 * 24 * 3600) -> int:
+        "delete delivered entries created more than `older_than` seconds ago"
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM entries WHERE status = 'done' AND created < ?", (time.time() - older_than,)
+            )
+        return cursor.rowcount
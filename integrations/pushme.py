@@ -2,15 +2,29 @@
 Notification service based on https://push.i-i.me/
 """
 
+import importlib
 from enum import Enum
+from typing import TYPE_CHECKING
 
 import requests
 
+from . import metrics
 from .utils import Config
 
+if TYPE_CHECKING:
+    from .outbox import Outbox
+
+URL = "https://push.i-i.me"
 cfg = Config()
 
 
+def __getattr__(name: str):
+    "`pushme.aio`: asyncio counterparts, imported on first access"
+    if name == "aio":
+        return importlib.import_module(".aio.pushme", __package__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def init(push_key: str):
     global cfg
     cfg.push_key = push_key
@@ -28,15 +42,17 @@ class Theme(Enum):
 
 
 @cfg.check_initialized
-def push(title: str, content: str, type: str = "markdown", theme: Theme = Theme.info):
+def push(title: str, content: str, type: str = "markdown", theme: Theme = Theme.info, outbox: "Outbox | None" = None):
     """Push a notification to your device.
 
     - type: markdown | text
-    - theme: Theme (info, success, warning, failure)
+    - theme: Theme (info, success, warning, failure), or its value
+    - outbox: if set, a failed push is enqueued to be sent later instead of raising
 
     docs: https://push.i-i.me/docs/index
     """
-    url = "https://push.i-i.me"
+    theme = Theme(theme)
+    url = URL
     data = {
         "push_key": cfg.push_key,
         "title": str(theme) + title,
@@ -44,6 +60,15 @@ def push(title: str, content: str, type: str = "markdown", theme: Theme = Theme.
         "type": type,
     }
     # headers = {"Content-Type": "application/json"}
-    response = requests.post(url, json=data, timeout=5)
-    response.raise_for_status()
+    try:
+        with metrics.operation("pushme", "push") as call:
+            response = requests.post(url, json=data, timeout=5)
+            call.observe(response)
+        response.raise_for_status()
+    except requests.RequestException:
+        if outbox is None:
+            raise
+        outbox.enqueue(
+            "integrations.pushme:push", wait=True, title=title, content=content, type=type, theme=theme.value
+        )
     return
@@ -1,3 +1,5 @@
+import importlib
+
 from addict import Dict
 
 
@@ -21,3 +23,28 @@ class Config(Dict):
 
     def mark_initialized(self):
         self.initialized = True
+
+
+class LazyImport:
+    "module proxy, import the (heavy, optional) module on first attribute access"
+
+    def __init__(self, name: str, extra: str):
+        """
+        name: module to import, eg. "openai"
+        extra: optional dependency group providing it, used in the error message
+        """
+        self._name = name
+        self._extra = extra
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError as e:
+                raise ImportError(
+                    f"{self._name} is required, install it with `pip install \"integrations[{self._extra}]\"`"
+                ) from e
+        return getattr(self._module, attr)
@@ -1,19 +1,54 @@
+import hashlib
 import io
+import json
+import os
+import shutil
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Generator, Iterable
+from urllib.parse import urlsplit
 
 import requests
-from webdav3.client import Client
+from loguru import logger
+
+from . import metrics
+from .utils import LazyImport
+
+webdav_client = LazyImport("webdav3.client", "webdav")  # imported on first use
+webdav_urn = LazyImport("webdav3.urn", "webdav")
+
+CHUNK_SIZE = 1 << 20  # 1 MiB per streamed chunk / ranged part
+RANGE_THRESHOLD = 8 << 20  # files larger than this are fetched with parallel Range requests
+
+
+def _etag(value: str) -> str:
+    "normalize ETag from HEAD / PROPFIND (weak prefix and quotes)"
+    return value.removeprefix("W/").strip('"')
+
+
+class _RangeUnusable(Exception):
+    "a ranged part can't be used: Range ignored, or the file changed since HEAD"
 
 
 class JGY:
     def __init__(
-        self, hostname: str, username: str, password: str, root: str = "Files"
+        self,
+        hostname: str,
+        username: str,
+        password: str,
+        root: str = "Files",
+        cache_dir: str | None = None,
+        max_workers: int = 8,
     ) -> None:
         """
         坚果云 jianguoyun WebDAV client
         manage files in specified remote root folder.
         Note: avoid subfolder related operations (not tested thoroughly)
+
+        cache_dir: local folder caching downloaded files (validated by ETag), None to disable
+        max_workers: concurrency of ranged parts / multi-file downloads
         """
 
         options = {
@@ -23,18 +58,28 @@ class JGY:
             "disable_check": True,  # 坚果云不支持 check，会无法访问资源
             "verbose": True,
         }
-        self.client = Client(options)
+        self.client = webdav_client.Client(options)
+        self.host = urlsplit(hostname).netloc
         self.root = root
-        if not any(
-            i["name"] == self.root and i["isdir"]
-            for i in self.client.list(get_info=True)
-        ):
+        self.max_workers = max_workers
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.session = requests.Session()  # raw GET/HEAD for downloads, with pooled connections
+        self.session.auth = (username, password)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        with metrics.operation("webdav", "list", self.host):
+            listing = self.client.list(get_info=True)
+        if not any(i["name"] == self.root and i["isdir"] for i in listing):
             self.client.mkdir(self.root)  # init
 
     @property
     def resources(self):
         # 默认存在根目录，去掉它
-        return self.client.list(remote_path=self.root, get_info=True)[1:]
+        with metrics.operation("webdav", "list", self.host):
+            return self.client.list(remote_path=self.root, get_info=True)[1:]
 
     def exists(self, filename: str) -> bool:
         return any(r["name"] == filename for r in self.resources)
@@ -56,7 +101,9 @@ class JGY:
             assert not self.exists(filename), "file already exists in remote"
 
         dest = f"{self.root}/{filename}"
-        self.client.upload(dest, source)
+        with metrics.operation("webdav", "upload", self.host) as call:
+            self.client.upload(dest, source)
+            call.bytes_sent += Path(source).stat().st_size
         return dest
 
     def upload_file_obj(self, file: io.BytesIO, filename: str) -> str:
@@ -67,13 +114,206 @@ class JGY:
         with tempfile.NamedTemporaryFile() as temp_file:
             with temp_file.file as f:
                 f.write(file.read())
-            self.client.upload(dest, temp_file.name)
+            with metrics.operation("webdav", "upload", self.host) as call:
+                self.client.upload(dest, temp_file.name)
+                call.bytes_sent += Path(temp_file.name).stat().st_size
         return dest
 
     def upload_url(self, url: str, filename: str) -> str:
         assert not self.exists(filename), "file already exists in remote"
-        response = requests.get(url)
+        with metrics.operation("webdav", "fetch_url") as call:
+            response = requests.get(url)
+            call.observe(response)
         response.raise_for_status()
         dest = f"{self.root}/{filename}"
-        self.client.upload_to(buff=response.content, remote_path=dest)
+        with metrics.operation("webdav", "upload", self.host) as call:
+            self.client.upload_to(buff=response.content, remote_path=dest)
+            call.bytes_sent += len(response.content)
+        return dest
+
+    # ---- download ----
+
+    def _url(self, filename: str) -> str:
+        return self.client.get_url(webdav_urn.Urn(f"{self.root}/{filename}").quote())
+
+    def _stat(self, filename: str) -> tuple[str | None, int | None]:
+        "return (etag, size) of a remote file with a HEAD request"
+        with metrics.operation("webdav", "head", self.host) as call:
+            response = self.session.head(self._url(filename))
+            call.status = str(response.status_code)
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        return response.headers.get("ETag"), int(size) if size is not None else None
+
+    def _cache_path(self, filename: str) -> Path:
+        assert self.cache_dir is not None
+        key = hashlib.sha1(f"{self.root}/{filename}".encode()).hexdigest()
+        return self.cache_dir / key
+
+    def _cached(self, filename: str, etag: str | None) -> Path | None:
+        "return cached file path if its ETag matches the remote one"
+        if self.cache_dir is None or not etag:
+            return None
+        path = self._cache_path(filename)
+        meta = path.with_suffix(".json")
+        if not (path.is_file() and meta.is_file()):
+            return None
+        return path if _etag(json.loads(meta.read_text())["etag"]) == _etag(etag) else None
+
+    def _store(self, filename: str, etag: str | None, source: Path) -> Path:
+        "move a downloaded file into cache, return its cached path"
+        path = self._cache_path(filename)
+        os.replace(source, path)
+        if etag:
+            path.with_suffix(".json").write_text(json.dumps({"etag": etag}))
+        return path
+
+    def _fetch(self, filename: str, dest: Path, size: int | None, etag: str | None) -> str | None:
+        """
+        download a remote file to dest, using parallel Range requests for large files
+        return the ETag of the downloaded content
+        """
+        url = self._url(filename)
+        if size is not None and size >= RANGE_THRESHOLD and self.max_workers > 1 and etag:
+            try:
+                self._fetch_ranges(url, dest, size, etag)
+                return etag
+            except _RangeUnusable as e:
+                logger.warning(f"{e}, download {filename} in one request")
+
+        with metrics.operation("webdav", "download", self.host) as call:
+            with self.session.get(url, stream=True) as response:
+                call.status = str(response.status_code)
+                response.raise_for_status()
+                with open(dest, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        call.bytes_received += len(chunk)
+        return response.headers.get("ETag") or etag
+
+    def _fetch_ranges(self, url: str, dest: Path, size: int, etag: str) -> None:
+        "download parts of one version (`etag`) of the file in parallel, raise `_RangeUnusable` if not possible"
+
+        part_size = max(CHUNK_SIZE, -(-size // self.max_workers))
+        ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+        with open(dest, "wb") as f:
+            f.truncate(size)
+
+        def fetch_part(byte_range: tuple[int, int]) -> None:
+            start, end = byte_range
+            headers = {"Range": f"bytes={start}-{end}"}
+            if not etag.startswith("W/"):  # If-Range needs a strong ETag
+                headers["If-Range"] = etag
+            with (
+                metrics.operation("webdav", "download_range", self.host) as call,
+                self.session.get(url, headers=headers, stream=True) as response,
+            ):
+                call.status = str(response.status_code)
+                response.raise_for_status()
+                if response.status_code != 206:  # Range ignored, or If-Range failed: the file changed
+                    raise _RangeUnusable(f"range request answered with {response.status_code}")
+                if (part_etag := response.headers.get("ETag")) and _etag(part_etag) != _etag(etag):
+                    raise _RangeUnusable("file changed during download")
+                with open(dest, "r+b") as f:
+                    f.seek(start)
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        call.bytes_received += len(chunk)
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            list(pool.map(fetch_part, ranges))
+
+    def _download(self, filename: str, etag: str | None, size: int | None) -> Path:
+        "return a local path holding the remote file content (cache hit or fresh download)"
+        if cached := self._cached(filename, etag):
+            return cached
+        folder = self.cache_dir or Path(tempfile.gettempdir())
+        fd, temp = tempfile.mkstemp(dir=folder, suffix=".part")
+        os.close(fd)
+        try:
+            etag = self._fetch(filename, Path(temp), size, etag)
+        except BaseException:
+            os.remove(temp)
+            raise
+        return self._store(filename, etag, Path(temp)) if self.cache_dir else Path(temp)
+
+    def _deliver(self, local: Path, dest: str) -> str:
+        "copy (cache) or move (temp file) local content to dest"
+        if self.cache_dir:
+            shutil.copyfile(local, dest)
+        else:
+            shutil.move(local, dest)
         return dest
+
+    def download_file(self, filename: str, dest: str | None = None) -> str:
+        """
+        filename: remote file name inside root folder
+        dest: local file path, default the same name in current folder
+        return: local file path
+        """
+        etag, size = self._stat(filename)
+        return self._deliver(self._download(filename, etag, size), dest or filename)
+
+    def _stream(self, filename: str, chunk_size: int, f=None) -> Generator[bytes, None, str | None]:
+        "yield content of a remote file chunk by chunk (also written to `f` if set), return its ETag"
+        # measured by hand like `llm._stream`: the call runs across yields
+        call = metrics.Call("webdav", "download", self.host)
+        start = time.perf_counter()
+        try:
+            with self.session.get(self._url(filename), stream=True) as response:
+                call.status = str(response.status_code)
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size):
+                    call.bytes_received += len(chunk)
+                    if f is not None:
+                        f.write(chunk)
+                    yield chunk
+            return response.headers.get("ETag")
+        except Exception as e:
+            call.status = call.status or type(e).__name__
+            raise
+        finally:
+            call.latency = time.perf_counter() - start
+            metrics.record(call)
+
+    def iter_file(self, filename: str, chunk_size: int = CHUNK_SIZE) -> Generator[bytes, None, None]:
+        "yield content of a remote file chunk by chunk, served from cache if unchanged"
+        etag, _ = self._stat(filename)
+        if (cached := self._cached(filename, etag)) is None and self.cache_dir is None:
+            yield from self._stream(filename, chunk_size)
+            return
+
+        if cached is None:  # cache while downloading
+            fd, temp = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+            os.close(fd)
+            try:
+                with open(temp, "wb") as f:
+                    etag = (yield from self._stream(filename, chunk_size, f)) or etag
+                self._store(filename, etag, Path(temp))
+            finally:  # abandoned generator or error
+                if os.path.exists(temp):
+                    os.remove(temp)
+            return
+
+        with open(cached, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def download_files(self, filenames: Iterable[str], dest_dir: str) -> dict[str, str]:
+        """
+        download multiple files concurrently, ETags are read from one folder listing
+        return: {filename: local file path}
+        """
+        with metrics.operation("webdav", "list", self.host):
+            listing = self.client.list(remote_path=self.root, get_info=True)
+        info = {r["name"]: r for r in listing if not r["isdir"]}
+        Path(dest_dir).mkdir(parents=True, exist_ok=True)
+
+        def download(filename: str) -> tuple[str, str]:
+            assert filename in info, f"{filename} does not exist in remote"
+            size = info[filename].get("size")
+            local = self._download(filename, info[filename].get("etag"), int(size) if size else None)
+            return filename, self._deliver(local, str(Path(dest_dir) / filename))
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            return dict(pool.map(download, filenames))